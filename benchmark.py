@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark the utils.py data paths on synthetic data.
+
+    python benchmark.py --rows 1000 100000 1000000 --output benchmark_results.json
+
+For every scale a fresh users.csv/expenses.csv is generated in a scratch
+directory (expenses per user follow a Zipf distribution, so a few users own
+most rows) and each path is timed in its own process. Results are printed and
+written as JSON so runs can be compared.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+def generate_data(directory, rows, users, skew, seed=0):
+    """Write synthetic users.csv and expenses.csv into directory"""
+    import utils
+    rng = np.random.default_rng(seed)
+    names = np.array([f"user{i:07d}" for i in range(users)])
+
+    users_df = pd.DataFrame({
+        "Name": names,
+        "Password": "1234",
+        "Age": rng.integers(17, 30, users),
+        "Gender": rng.choice(["Male", "Female", "Other"], users),
+    })
+    for category in utils.EXPENSE_CATEGORIES:
+        users_df[category] = rng.choice([0, 50, 100, 200, 500, 1000, 3000], users).astype(float)
+    users_df["Monthly_Income"] = rng.choice([3000, 5000, 10000, 15000, 20000], users).astype(float)
+    users_df.to_csv(os.path.join(directory, utils.USERS_FILE), index=False)
+
+    # Zipf-like ownership: user i gets a share proportional to 1 / (i + 1) ** skew
+    weights = 1.0 / np.arange(1, users + 1) ** skew
+    owners = rng.choice(users, size=rows, p=weights / weights.sum())
+    dates = np.datetime64('2024-01-01') + rng.integers(0, 730, rows)
+    expenses_df = pd.DataFrame({
+        "Username": names[owners],
+        "Category": np.array(utils.EXPENSE_CATEGORIES)[rng.integers(0, len(utils.EXPENSE_CATEGORIES), rows)],
+        "Amount": rng.lognormal(5, 1, rows).round(2),
+        "Date": dates.astype(str),
+        "Note": "",
+    })
+    expenses_df.to_csv(os.path.join(directory, utils.EXPENSES_FILE), index=False)
+    return names[0], names[users // 2]
+
+def measure(name, func, rows, repeat):
+    """Median wall time over repeat runs, plus peak traced memory of one extra run"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    seconds = float(np.median(timings))
+    return {
+        "path": name,
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds > 0 else None,
+        "peak_mb": peak / 2 ** 20,
+    }
+
+def run_scale(directory, rows, users, skew, repeat, appends):
+    """Time every path against one generated dataset (runs inside the scratch directory)"""
+    os.chdir(directory)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import utils
+
+    heavy_user, median_user = generate_data(directory, rows, users, skew)
+    if utils.STORAGE_BACKEND == 'columnar':
+        utils.migrate_csv_to_columnar()
+    elif utils.STORAGE_BACKEND == 'sqlite':
+        utils.migrate_csv_to_sqlite()
+    results = []
+    results.append(measure("load_expense_data", utils.load_expense_data, rows, repeat))
+    results.append(measure("load_expense_data(compact=True)",
+                           lambda: utils.load_expense_data(compact=True), rows, repeat))
+    # Resident size of the loaded table: default dtypes, plain object strings and the compact form
+    for result, frame in ((results[0], utils.load_expense_data()),
+                          (results[1], utils.load_expense_data(compact=True))):
+        result["bytes_per_row"] = frame.memory_usage(deep=True).sum() / max(len(frame), 1)
+    results[0]["object_bytes_per_row"] = (utils.load_expense_data().astype(object).memory_usage(deep=True).sum()
+                                          / max(rows, 1))
+    # Build the sorted base file + offset index the dashboard path relies on
+    utils.compact_expense_journal()
+
+    expenses_df = utils.load_expense_data()
+    users_df = utils.load_user_data()
+    heavy_rows = int((expenses_df['Username'] == heavy_user).sum())
+    median_rows = int((expenses_df['Username'] == median_user).sum())
+    for label, username, user_rows in (("heavy", heavy_user, heavy_rows), ("median", median_user, median_rows)):
+        user_data = users_df[users_df['Name'] == username].iloc[0]
+        user_expenses = utils.get_user_expenses(expenses_df, username)
+        results.append(measure(f"load_user_expenses[{label}]",
+                               lambda: utils.load_user_expenses(username), user_rows, repeat))
+        results.append(measure(f"get_user_expenses[{label}]",
+                               lambda: utils.get_user_expenses(expenses_df, username), user_rows, repeat))
+        results.append(measure(f"calculate_expense_metrics[{label}]",
+                               lambda: utils.calculate_expense_metrics(user_data, user_expenses), user_rows, repeat))
+        results.append(measure(f"calculate_expense_metrics_cached[{label}]",
+                               lambda: utils.calculate_expense_metrics(user_data), user_rows, repeat))
+        results.append(measure(f"generate_optimization_tips[{label}]",
+                               lambda: utils.generate_optimization_tips(user_data, user_expenses), user_rows, repeat))
+
+    totals = expenses_df.groupby('Username')['Amount'].sum()
+    results.append(measure("generate_optimization_tips_batch",
+                           lambda: utils.generate_optimization_tips_batch(users_df, totals), users, repeat))
+
+    # Add-expense save path: queued journal appends vs the old full-file rewrite
+    expense = {"Username": median_user, "Category": "Utilities", "Amount": 10.0, "Date": "2025-01-01", "Note": ""}
+    def append_many():
+        for _ in range(appends):
+            utils.add_expenses([dict(expense)])
+            utils.update_user_value(median_user, "Utilities", 10.0)
+    results.append(measure(f"add_expenses+update_user_value[x{appends}]", append_many, appends, 1))
+    results.append(measure("flush_writes", utils.flush_writes, appends, 1))
+    registration = iter(range(10 ** 9))
+    def register():
+        name = f"bench{next(registration)}"
+        utils.add_user({"Name": name, "Password": "1234", "Age": 20, "Gender": "Other", "Utilities": 100.0})
+        utils.add_expenses([{"Username": name, "Category": category, "Amount": 100.0, "Date": "2025-01-01"}
+                            for category in utils.EXPENSE_CATEGORIES])
+    results.append(measure("register (add_user + 10 initial expenses)", register, 1, repeat))
+    results.append(measure("save_expense_data (full rewrite)",
+                           lambda: utils.save_expense_data(utils.load_expense_data()), rows, 1))
+    utils.flush_writes()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the utils.py data paths")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Expense rows per scale (10**3 .. 10**7)")
+    parser.add_argument('--users-per-row', type=float, default=0.02,
+                        help="Users generated per expense row (default: 1 user per 50 rows)")
+    parser.add_argument('--skew', type=float, default=1.1, help="Zipf exponent of rows per user")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per path")
+    parser.add_argument('--appends', type=int, default=1000, help="Single expenses added in the save-path test")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON results file")
+    parser.add_argument('--worker', nargs=2, metavar=('DIRECTORY', 'ROWS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        directory, rows = args.worker[0], int(args.worker[1])
+        users = max(10, int(rows * args.users_per_row))
+        results = run_scale(directory, rows, users, args.skew, args.repeat, args.appends)
+        json.dump(results, sys.stdout)
+        return
+
+    report = {
+        "started": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "storage_backend": os.environ.get('BUDGET_STORAGE_BACKEND', 'csv'),
+        "scales": [],
+    }
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as directory:
+            # A fresh process per scale so module-level caches start empty
+            worker = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', directory, str(rows),
+                 '--users-per-row', str(args.users_per_row), '--skew', str(args.skew),
+                 '--repeat', str(args.repeat), '--appends', str(args.appends)],
+                check=True, capture_output=True, text=True
+            )
+        results = json.loads(worker.stdout)
+        report["scales"].append({"rows": rows, "results": results})
+
+        print(f"\n{rows:,} expense rows")
+        print(f"{'path':<45}{'rows':>10}{'seconds':>12}{'rows/s':>14}{'peak MB':>10}")
+        for result in results:
+            throughput = f"{result['rows_per_second']:,.0f}" if result['rows_per_second'] else '-'
+            print(f"{result['path']:<45}{result['rows']:>10,}{result['seconds']:>12.5f}"
+                  f"{throughput:>14}{result['peak_mb']:>10.1f}")
+        for result in results:
+            if 'bytes_per_row' in result:
+                print(f"resident bytes/row, {result['path']}: {result['bytes_per_row']:.1f}")
+        print(f"resident bytes/row, object dtype: {results[0]['object_bytes_per_row']:.1f}")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bulk import expenses from a CSV or OFX/QFX bank statement.
+
+    python import_expenses.py statement.csv --user "Reinee Panjabi"
+    python import_expenses.py export.ofx --user "Reinee Panjabi"
+
+CSV files need Date and Amount columns (common bank header names are
+recognised); without --user each row must carry a Username column naming a
+registered user. Credits (negative amounts, or a Credit/Deposit column) are
+skipped; pass --debits-negative for statements that sign money spent negative.
+Dates are read with one format per statement: ISO if the dates are, otherwise
+day first (13/04/2025) unless --month-first is given; --date-format sets it
+explicitly. Rows with dates in any other format are counted as invalid.
+"""
+
+import argparse
+import time
+from utils import import_expenses, flush_writes, IMPORT_CHUNK_ROWS
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import expenses")
+    parser.add_argument('statement', help="CSV or OFX/QFX file")
+    parser.add_argument('--user', help="Import every row for this username")
+    parser.add_argument('--format', choices=['csv', 'ofx'], help="Override format detection")
+    parser.add_argument('--debits-negative', action='store_true',
+                        help="CSV amounts are negative for money spent (as in OFX)")
+    parser.add_argument('--date-format', help="strptime format of the CSV dates, e.g. %%d/%%m/%%Y")
+    parser.add_argument('--month-first', action='store_true',
+                        help="Read ambiguous CSV dates as month first (04/13/2025)")
+    parser.add_argument('--chunk-rows', type=int, default=IMPORT_CHUNK_ROWS, help="Rows parsed per chunk")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    summary = import_expenses(args.statement, username=args.user, file_format=args.format,
+                              chunk_rows=args.chunk_rows, debits_negative=args.debits_negative,
+                              date_format=args.date_format, dayfirst=not args.month_first)
+    flush_writes()
+    elapsed = time.perf_counter() - start
+    print(f"Imported {summary['imported']} expenses ({summary['duplicates']} duplicates, "
+          f"{summary['credits']} credits, {summary['unknown_users']} for unknown users, "
+          f"{summary['invalid']} invalid) in {elapsed:.2f}s")
+
+if __name__ == "__main__":
+    main()
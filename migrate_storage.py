@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Convert the budget tracker data between the CSV and columnar storage backends.
+
+    python migrate_storage.py to-columnar
+    python migrate_storage.py to-sqlite
+    python migrate_storage.py to-csv [--from columnar|sqlite] [--users users.csv] [--expenses expenses.csv]
+
+Set BUDGET_STORAGE_BACKEND=columnar (or sqlite) to run the app on the migrated data.
+"""
+
+import argparse
+from utils import (
+    migrate_csv_to_columnar, export_columnar_to_csv,
+    migrate_csv_to_sqlite, export_sqlite_to_csv
+)
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate budget tracker storage")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('to-columnar', help="Convert users.csv/expenses.csv to Arrow files")
+    subparsers.add_parser('to-sqlite', help="Load users.csv/expenses.csv into the SQLite database")
+    export_parser = subparsers.add_parser('to-csv', help="Export the Arrow files or database back to CSV")
+    export_parser.add_argument('--from', dest='source', choices=['columnar', 'sqlite'], default='columnar',
+                               help="Storage to export (default: columnar)")
+    export_parser.add_argument('--users', help="Output path for users (default: users.csv)")
+    export_parser.add_argument('--expenses', help="Output path for expenses (default: expenses.csv)")
+    args = parser.parse_args()
+
+    if args.command == 'to-columnar':
+        users, expenses = migrate_csv_to_columnar()
+    elif args.command == 'to-sqlite':
+        users, expenses = migrate_csv_to_sqlite()
+    elif args.source == 'sqlite':
+        users, expenses = export_sqlite_to_csv(args.users, args.expenses)
+    else:
+        users, expenses = export_columnar_to_csv(args.users, args.expenses)
+    print(f"Migrated {users} users and {expenses} expenses")
+
+if __name__ == "__main__":
+    main()
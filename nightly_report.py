@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Nightly budget report over all users.
+
+    python nightly_report.py --output budget_report.csv --workers 8
+
+Streams expenses.csv in user partitions across a process pool (each worker
+holds at most one partition of the file plus one parsed chunk), then writes
+one row per user with the dashboard metrics, spending per category and the
+optimization tips. A .json output path writes JSON records instead of CSV.
+"""
+
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from utils import (
+    load_user_data, snapshot_expense_partitions, expense_partition_totals,
+    expense_category_totals, merge_category_totals, expense_report,
+    EXPENSES_FILE, REPORT_PARTITION_BYTES, REPORT_CHUNK_ROWS
+)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute metrics and tips for every user")
+    parser.add_argument('--output', default='budget_report.csv', help="Report file (.csv or .json)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument('--partition-mb', type=float, default=REPORT_PARTITION_BYTES / 2 ** 20,
+                        help="Most of expenses.csv one worker reads at once")
+    parser.add_argument('--chunk-rows', type=int, default=REPORT_CHUNK_ROWS, help="Rows parsed per chunk")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    # Next to expenses.csv so it can be a hard link rather than a copy
+    snapshot = f"{EXPENSES_FILE}.{os.getpid()}.snapshot"
+    try:
+        # Several partitions per worker so a heavy user's partition doesn't leave the others idle
+        partitions, journal_df = snapshot_expense_partitions(
+            snapshot, parts=args.workers * 4, max_bytes=int(args.partition_mb * 2 ** 20)
+        )
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [pool.submit(expense_partition_totals, snapshot, begin, end, args.chunk_rows)
+                       for begin, end in partitions]
+            users_df = load_user_data()
+            partition_totals = [future.result() for future in futures]
+    finally:
+        if os.path.exists(snapshot):
+            os.remove(snapshot)
+
+    # Partitions hold disjoint users; rows journaled after the snapshot are added on top
+    category_totals = merge_category_totals(partition_totals + [expense_category_totals(journal_df)])
+    report = expense_report(users_df, category_totals)
+    if args.output.lower().endswith('.json'):
+        report.to_json(args.output, orient='records', indent=2)
+    else:
+        report.to_csv(args.output, index=False)
+    elapsed = time.perf_counter() - start
+    print(f"Reported {len(report)} users from {len(partitions)} partitions "
+          f"with {args.workers} workers in {elapsed:.2f}s -> {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Concurrent writers against one data directory.
+
+Every scenario runs its sessions in spawned processes (utils keeps its caches
+and the storage paths at module level, and reads BUDGET_STORAGE_BACKEND on
+import), all working in a fresh temporary directory.
+"""
+
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+WORKERS = 4
+ROWS_PER_WORKER = 100
+UPDATE_EVERY = 5
+
+@pytest.fixture(params=['csv', 'columnar', 'sqlite'])
+def data_dir(request, tmp_path, monkeypatch):
+    """Empty data directory with two users, for each storage backend"""
+    if request.param == 'columnar':
+        pytest.importorskip('pyarrow')
+    monkeypatch.setenv('BUDGET_STORAGE_BACKEND', request.param)
+    monkeypatch.setenv('BUDGET_DATABASE_FILE', str(tmp_path / 'budget.db'))
+    _call(tmp_path, _setup)
+    return tmp_path
+
+def _call(directory, func, *args):
+    """Run func in a new process working in directory and return its result"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn'),
+                             initializer=os.chdir, initargs=(str(directory),)) as pool:
+        return pool.submit(func, *args).result()
+
+def _run_sessions(directory, target, args_list):
+    """Run target(directory, *args) in one process per args tuple and wait for all of them"""
+    context = mp.get_context('spawn')
+    processes = [context.Process(target=target, args=(str(directory),) + args) for args in args_list]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=300)
+    assert [process.exitcode for process in processes] == [0] * len(processes)
+
+def _setup():
+    import utils
+    for name in ('alice', 'bob'):
+        assert utils.add_user({'Name': name, 'Password': 'x', 'Age': 20, 'Gender': 'Female',
+                               'Utilities': 0, 'Monthly_Income': 1000})
+    utils.flush_writes()
+
+def _expense(worker, row):
+    return {'Username': 'alice', 'Category': 'Utilities', 'Amount': 1.0,
+            'Date': '2025-01-01', 'Note': f'{worker}-{row}'}
+
+def _append_session(directory, worker, compact_rows):
+    os.chdir(directory)
+    import utils
+    utils.JOURNAL_COMPACT_ROWS = compact_rows
+    for row in range(ROWS_PER_WORKER):
+        utils.add_expenses([_expense(worker, row)])
+        if row % UPDATE_EVERY == 0:
+            utils.update_user_value('alice', 'Utilities', 1)
+    utils.flush_writes()
+    utils.flush_expense_journal()
+
+def _compaction_session(directory, stop):
+    os.chdir(directory)
+    import utils
+    while not stop.is_set():
+        utils.compact_expense_journal()
+    utils.compact_expense_journal()
+
+def _stored_state():
+    import utils
+    expenses = utils.load_expense_data()
+    users = utils.load_user_data()
+    return (sorted(expenses['Note'].dropna().tolist()),
+            float(users.loc[users['Name'] == 'alice', 'Utilities'].iloc[0]),
+            sorted(users['Name'].tolist()))
+
+def _expected_notes():
+    return sorted(f'{worker}-{row}' for worker in range(WORKERS) for row in range(ROWS_PER_WORKER))
+
+def test_concurrent_appends_keep_every_row(data_dir):
+    _run_sessions(data_dir, _append_session, [(worker, 10 ** 9) for worker in range(WORKERS)])
+    notes, utilities, names = _call(data_dir, _stored_state)
+    assert notes == _expected_notes()
+    assert utilities == WORKERS * ROWS_PER_WORKER / UPDATE_EVERY
+    assert names == ['alice', 'bob']
+
+def test_appends_during_compaction_keep_every_row(data_dir):
+    context = mp.get_context('spawn')
+    stop = context.Event()
+    compactor = context.Process(target=_compaction_session, args=(str(data_dir), stop))
+    compactor.start()
+    try:
+        # A low threshold makes the appending sessions start compactions of their own too
+        _run_sessions(data_dir, _append_session, [(worker, 20) for worker in range(WORKERS)])
+    finally:
+        stop.set()
+        compactor.join(timeout=300)
+    assert compactor.exitcode == 0
+    notes, utilities, _ = _call(data_dir, _stored_state)
+    assert notes == _expected_notes()
+    assert utilities == WORKERS * ROWS_PER_WORKER / UPDATE_EVERY
+
+def _stale_saves():
+    import utils
+    results = {}
+    # Rows and users added since the load are merged into the save
+    stale = utils.load_expense_data()
+    utils.add_expenses([_expense('late', 0)])
+    utils.flush_writes()
+    results['expenses_merged'] = utils.save_expense_data(stale)
+    stale_users = utils.load_user_data()
+    utils.add_user({'Name': 'carol', 'Password': 'x', 'Age': 20, 'Gender': 'Female'})
+    # (Arrow users files are rewritten on registration, so there the save fails instead)
+    results['users_merged'] = utils.save_user_data(stale_users) == (utils.STORAGE_BACKEND != 'columnar')
+
+    # A rewrite since the load makes the save fail
+    stale = utils.load_expense_data()
+    assert utils.save_expense_data(utils.load_expense_data())
+    results['expenses_rewritten'] = utils.save_expense_data(stale)
+    stale_users = utils.load_user_data()
+    assert utils.save_user_data(utils.load_user_data())
+    results['users_rewritten'] = utils.save_user_data(stale_users)
+
+    if utils.STORAGE_BACKEND != 'sqlite':
+        # So does a compaction, which rewrites the base expenses file
+        stale = utils.load_expense_data()
+        utils.add_expenses([_expense('late', 1)])
+        utils.flush_writes()
+        utils.compact_expense_journal()
+        results['expenses_compacted'] = utils.save_expense_data(stale)
+    return results, _stored_state()
+
+def test_save_fails_after_rewrite(data_dir):
+    results, (notes, _, names) = _call(data_dir, _stale_saves)
+    assert results.pop('expenses_merged') and results.pop('users_merged')
+    assert not any(results.values())
+    assert notes == sorted(['late-0'] + (['late-1'] if 'expenses_compacted' in results else []))
+    assert names == ['alice', 'bob', 'carol']
@@ -0,0 +1,113 @@
+"""
+Statement import: the CSV and OFX readers, date formats, credits and dedupe.
+
+The readers and the date handling are checked in this process; whole imports
+run in a spawned process working in a fresh temporary directory, as utils
+keeps the storage paths and its caches at module level.
+"""
+
+import io
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import utils
+
+OFX_STATEMENT = b"""OFXHEADER:100
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20250413120000<TRNAMT>-250.50<NAME>Grocer</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20250501<TRNAMT>1000.00<MEMO>Salary</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+def _call(directory, func, *args):
+    """Run func in a new process working in directory and return its result"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn'),
+                             initializer=os.chdir, initargs=(str(directory),)) as pool:
+        return pool.submit(func, *args).result()
+
+def _read_csv(text, **kwargs):
+    return pd.concat(utils._read_csv_statement(io.StringIO(text), 100, **kwargs), ignore_index=True)
+
+def test_csv_reader_maps_bank_headers():
+    chunk = _read_csv("Transaction Date,Narration,Withdrawal Amount\n13/04/2025,Rent,\"₹1,200.50\"\n")
+    assert chunk.loc[0, ['Date', 'Note', 'Amount']].tolist() == ['13/04/2025', 'Rent', 1200.5]
+    assert chunk['Username'].isna().all() and chunk['Category'].isna().all()
+
+def test_csv_reader_signs_credits_negative():
+    chunk = _read_csv("Date,Amount\n2025-04-13,-50\n2025-04-14,75\n")
+    assert chunk['Amount'].tolist() == [-50.0, 75.0]
+    chunk = _read_csv("Date,Amount\n2025-04-13,-50\n2025-04-14,75\n", debits_negative=True)
+    assert chunk['Amount'].tolist() == [50.0, -75.0]
+    # A debit column stays money spent; a separate credit column marks credits
+    chunk = _read_csv("Date,Debit,Credit\n2025-04-13,50,\n2025-04-14,,300\n", debits_negative=True)
+    assert chunk['Amount'].tolist() == [50.0, -300.0]
+
+def test_ofx_reader_flips_signs_and_keeps_caller_file_open():
+    source = io.BytesIO(OFX_STATEMENT)
+    chunk = pd.concat(utils._read_ofx_statement(source, 100), ignore_index=True)
+    assert chunk['Amount'].tolist() == [250.5, -1000.0]
+    assert chunk['Date'].tolist() == ['20250413', '20250501']
+    assert chunk['Note'].tolist() == ['Grocer', 'Salary']
+    assert not source.closed
+
+def test_statement_date_format_is_picked_once():
+    dates = pd.Series(['13/04/2025', '01/05/2025'])
+    assert utils._statement_date_format(dates) == '%d/%m/%Y'
+    assert utils._statement_date_format(pd.Series(['04/13/2025']), dayfirst=False) == '%m/%d/%Y'
+    assert utils._statement_date_format(pd.Series(['2025-05-01', '01/05/2025'])) == '%Y-%m-%d'
+    assert utils._statement_date_format(pd.Series(['n/a', None])) is None
+
+def test_dates_outside_the_statement_format_are_invalid():
+    chunk = pd.DataFrame({'Username': 'alice', 'Category': None, 'Amount': [1.0, 2.0, 3.0, -4.0],
+                          'Date': ['13/04/2025', '01/05/2025', '2025-05-02', '03/05/2025'], 'Note': None})
+    rows, invalid, credits = utils._normalize_import_chunk(chunk, None, '%d/%m/%Y')
+    assert rows['Date'].tolist() == ['2025-04-13', '2025-05-01']
+    assert rows['Category'].tolist() == ['Other', 'Other']
+    assert (invalid, credits) == (1, 1)
+
+def _import_twice(statements):
+    for name in ('alice', 'bob'):
+        utils.add_user({'Name': name, 'Password': 'x', 'Age': 20, 'Gender': 'Female'})
+    summaries = [utils.import_expenses(io.StringIO(text), **kwargs) for text, kwargs in statements]
+    utils.flush_writes()
+    expenses = utils.load_expense_data()
+    return summaries, expenses[['Username', 'Amount', 'Date']].values.tolist()
+
+def test_import_dedupes_by_occurrence(tmp_path):
+    first = ("Username,Date,Amount,Category,Note\n"
+             "alice,13/04/2025,12,groceries,Lunch\n"
+             "alice,13/04/2025,12,groceries,Lunch\n"
+             "alice,01/05/2025,-500,,Refund\n"
+             "carol,01/05/2025,5,,\n"
+             "alice,sometime,5,,\n")
+    # The same two lunches plus a third on the same day: only the third is new
+    second = ("Username,Date,Amount,Category,Note\n"
+              "alice,13/04/2025,12,groceries,Lunch\n"
+              "alice,13/04/2025,12,groceries,Lunch\n"
+              "alice,13/04/2025,12,groceries,Lunch\n")
+    summaries, rows = _call(tmp_path, _import_twice, [(first, {}), (second, {})])
+    assert summaries == [
+        {'imported': 2, 'duplicates': 0, 'credits': 1, 'unknown_users': 1, 'invalid': 1},
+        {'imported': 1, 'duplicates': 2, 'credits': 0, 'unknown_users': 0, 'invalid': 0},
+    ]
+    assert rows == [['alice', 12.0, '2025-04-13']] * 3
+
+def test_import_username_and_month_first_dates(tmp_path):
+    statement = "Date,Debit,Credit\n04/13/2025,20,\n05/01/2025,,100\n"
+    summaries, rows = _call(tmp_path, _import_twice, [(statement, {'username': 'bob', 'dayfirst': False})])
+    assert summaries == [{'imported': 1, 'duplicates': 0, 'credits': 1, 'unknown_users': 0, 'invalid': 0}]
+    assert rows == [['bob', 20.0, '2025-04-13']]
+
+def _import_ofx():
+    utils.add_user({'Name': 'alice', 'Password': 'x', 'Age': 20, 'Gender': 'Female'})
+    summary = utils.import_expenses(io.BytesIO(OFX_STATEMENT), username='alice', file_format='ofx')
+    utils.flush_writes()
+    return summary, utils.load_expense_data()[['Amount', 'Date', 'Note']].values.tolist()
+
+def test_import_ofx(tmp_path):
+    summary, rows = _call(tmp_path, _import_ofx)
+    assert summary == {'imported': 1, 'duplicates': 0, 'credits': 1, 'unknown_users': 0, 'invalid': 0}
+    assert rows == [[250.5, '2025-04-13', 'Grocer']]
@@ -0,0 +1,61 @@
+"""
+The batch tip rules must give exactly the per-user generate_optimization_tips output.
+"""
+
+import numpy as np
+import pandas as pd
+
+import utils
+
+def _users():
+    """Edge cases (NaN and zero income, zero food, no expenses) plus random users"""
+    edge_cases = [
+        {'Monthly_Income': np.nan, 'Student_Accommodation': 500, 'Grocery_shopping': 100, 'Takeaways/dining': 50},
+        {'Monthly_Income': 0, 'Student_Accommodation': 500, 'Public_Transportation': 20, 'Entertainment': 10},
+        {'Monthly_Income': 1000, 'Grocery_shopping': 0, 'Takeaways/dining': 0},
+        {'Monthly_Income': 1000, 'Grocery_shopping': 0, 'Takeaways/dining': 200},
+        {'Monthly_Income': 1000, 'Student_Accommodation': np.nan, 'Entertainment': np.nan},
+        {'Monthly_Income': 1000, 'Student_Accommodation': 400, 'Grocery_shopping': 150,
+         'Takeaways/dining': 150, 'Public_Transportation': 100, 'Entertainment': 100},
+        {'Monthly_Income': -100, 'Student_Accommodation': 10},
+        {},
+    ]
+    rng = np.random.default_rng(6)
+    random_users = [
+        {category: float(rng.choice([0, rng.uniform(0, 800)])) for category in utils.EXPENSE_CATEGORIES}
+        | {'Monthly_Income': float(rng.choice([np.nan, 0, rng.uniform(100, 3000)]))}
+        for _ in range(200)
+    ]
+    users_df = pd.DataFrame(edge_cases + random_users).reindex(columns=utils.USER_COLUMNS)
+    users_df[utils.USER_COLUMNS[4:]] = users_df[utils.USER_COLUMNS[4:]].astype(float)
+    users_df['Name'] = [f'user{i}' for i in range(len(users_df))]
+    return users_df
+
+def _expenses(users_df):
+    """Expense rows for about two thirds of the users; the rest have none (a missing total)"""
+    rng = np.random.default_rng(7)
+    rows = []
+    for name in users_df['Name'][::3].tolist() + users_df['Name'][1::3].tolist():
+        for amount in rng.uniform(0, 700, rng.integers(1, 4)):
+            rows.append({'Username': name, 'Category': 'Other', 'Amount': float(amount),
+                         'Date': '2025-01-01', 'Note': None})
+    return pd.DataFrame(rows, columns=utils.EXPENSE_COLUMNS)
+
+def test_batch_tips_match_per_user_tips():
+    users_df = _users()
+    expenses_df = _expenses(users_df)
+    totals = expenses_df.groupby('Username')['Amount'].sum().to_dict()
+    matrix = utils.generate_optimization_tips_batch(users_df, totals)
+    for position in range(len(users_df)):
+        user_data = users_df.iloc[position]
+        user_expenses = expenses_df[expenses_df['Username'] == user_data['Name']]
+        expected = utils.generate_optimization_tips(user_data, user_expenses)
+        assert utils.tips_from_matrix(matrix.iloc[position]) == expected, user_data.to_dict()
+
+def test_batch_tips_without_totals_count_no_expenses():
+    users_df = _users()
+    matrix = utils.generate_optimization_tips_batch(users_df)
+    empty = pd.DataFrame(columns=utils.EXPENSE_COLUMNS)
+    for position in range(len(users_df)):
+        user_data = users_df.iloc[position]
+        assert utils.tips_from_matrix(matrix.iloc[position]) == utils.generate_optimization_tips(user_data, empty)
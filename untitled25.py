@@ -1,14 +1,19 @@
 
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
 import datetime
+import io
+# matplotlib is imported inside the chart renderers, so the login and
+# registration pages (and lightweight charts) never pay for loading it
 from utils import (
-    load_user_data, save_user_data,
-    load_expense_data, save_expense_data,
-    get_user_expenses,
-    calculate_expense_metrics
+    get_user_record, user_count, data_version,
+    add_user, add_expenses, update_user_value,
+    calculate_expense_metrics, import_expenses, expense_rollup, expense_totals_between, pending_alerts,
+    expense_history_page, HISTORY_PAGE_SIZE, HISTORY_SORT_COLUMNS,
+    EXPENSE_CATEGORIES, population_statistics, percentile_rank, peer_cohort,
+    span, profiled, set_profiling, profiling_enabled, reset_profile, profile_report, export_metrics,
+    PROFILING_ADMINS
 )
 
 # Set page configuration
@@ -24,15 +29,14 @@ if 'current_user' not in st.session_state:
     st.session_state.current_user = None
 if 'show_registration' not in st.session_state:
     st.session_state.show_registration = False
-
-# Load user data
-users_df = load_user_data()
-expenses_df = load_expense_data()
+if 'light_charts' not in st.session_state:
+    st.session_state.light_charts = False
 
 def authenticate_user(username, password):
     """Authenticate a user based on username and password"""
-    if username in users_df['Name'].values:
-        user_row = users_df[users_df['Name'] == username].iloc[0]
+    # O(1) lookup in the shared user index
+    user_row = get_user_record(username)
+    if user_row is not None:
         # Convert password for comparison - CSV stores integers as numeric
         stored_pass = str(user_row['Password'])
         if stored_pass == password:  
@@ -43,16 +47,10 @@ def authenticate_user(username, password):
 
 def register_user(user_data):
     """Register a new user with the provided data"""
-    global users_df
-   
-    # to Check if user already exists
-    if user_data['Name'] in users_df['Name'].values:
+    # Adding user through the shared data layer (fails if user already exists)
+    if not add_user(user_data):
         return False, "Username already exists!"
    
-    # Adding user to dataframe
-    users_df = pd.concat([users_df, pd.DataFrame([user_data])])
-    save_user_data(users_df)
-   
     # Set session state
     st.session_state.authenticated = True
     st.session_state.current_user = user_data['Name']
@@ -61,19 +59,85 @@ def register_user(user_data):
     return True,print("Registration successful!")
    
 
+@profiled
 def add_expense(expense_data):
    
-    global expenses_df
-   
-    # Adding expense to dataframe
+    # Adding expense through the shared data layer (journaled, no full rewrite)
     expense_data['Username'] = st.session_state.current_user
     expense_data['Date'] = datetime.datetime.now().strftime('%Y-%m-%d')
    
-    expenses_df = pd.concat([expenses_df, pd.DataFrame([expense_data])])
-    save_expense_data(expenses_df)
+    add_expenses([expense_data])
    
     return True
 
+# Rendered charts are cached per data version; bounded so memory stays flat
+CHART_CACHE_ENTRIES = 256
+
+@profiled
+def figure_png(fig):
+    """Render a figure to PNG bytes and release it"""
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    fig.clear()
+    return buffer.getvalue()
+
+def bar_figure(categories, amounts, title, ylabel, color):
+    """Category bar chart (a standalone Figure, never registered with pyplot)"""
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.bar(categories, amounts, color=color)
+    ax.set_title(title)
+    ax.set_xlabel('Category')
+    ax.set_ylabel(ylabel)
+    ax.tick_params(axis='x', labelrotation=45)
+    for label in ax.get_xticklabels():
+        label.set_horizontalalignment('right')
+    fig.tight_layout()
+    return fig
+
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES, show_spinner=False)
+def render_expense_charts(username, version, date_range, _expense_by_category):
+    """Pie and bar chart PNGs for a user, rendered once per data version and date range"""
+    from matplotlib import colormaps
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(8, 8))
+    ax = fig.subplots()
+    ax.pie(_expense_by_category['Amount'], labels=_expense_by_category['Category'], autopct='%1.1f%%')
+    ax.set_title('Expenses by Category')
+    pie_png = figure_png(fig)
+   
+    colors = colormaps['viridis'](np.linspace(0, 1, len(_expense_by_category)))
+    bar_png = figure_png(bar_figure(_expense_by_category['Category'], _expense_by_category['Amount'],
+                                    'Expenses by Category', 'Amount (₹)', colors))
+    return pie_png, bar_png
+
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES, show_spinner=False)
+def render_trend_chart(username, version, period, date_range, _trend_df):
+    """Stacked per-category spending bars over time, rendered once per data version and range"""
+    from matplotlib import colormaps
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(12, 5))
+    ax = fig.subplots()
+    colors = colormaps['viridis'](np.linspace(0, 1, len(_trend_df.columns)))
+    bottom = np.zeros(len(_trend_df))
+    for color, category in zip(colors, _trend_df.columns):
+        ax.bar(_trend_df.index, _trend_df[category], bottom=bottom, color=color, label=category)
+        bottom += _trend_df[category].to_numpy()
+    ax.set_title(f"{'Monthly' if period == 'month' else 'Weekly'} Spending Trend")
+    ax.set_xlabel('Month' if period == 'month' else 'Week starting')
+    ax.set_ylabel('Amount (₹)')
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.legend(fontsize='small', loc='upper left', bbox_to_anchor=(1, 1))
+    fig.tight_layout()
+    return figure_png(fig)
+
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES, show_spinner=False)
+def render_average_chart(version, _avg_expense_df):
+    """Average spending bar chart PNG, rendered once per data version"""
+    return figure_png(bar_figure(_avg_expense_df['Category'], _avg_expense_df['Average Amount'],
+                                 'Average Student Expenses by Category', 'Amount ($)', "teal"))
+
 def show_login_page():
     """Display the login page"""
     st.title("Student Budget Tracker")
@@ -100,7 +164,6 @@ def show_login_page():
 
 def show_registration_page():
     """Display the registration page"""
-    global expenses_df  
     st.title("Registration Form")
    
     with st.form("registration_form"):
@@ -144,6 +207,7 @@ def show_registration_page():
             }
            
             # Adding initial expenses
+            initial_expenses = []
             for category in ["Student_Accommodation", "Utilities", "Grocery_shopping",
                             "Takeaways/dining", "Public_Transportation", "Tuition_Fees",
                             "Books_and_Supplies", "Clothing", "Entertainment", "Health/Medical_Expenses"]:
@@ -154,12 +218,11 @@ def show_registration_page():
                         "Amount": user_data[category],
                         "Date": datetime.datetime.now().strftime('%Y-%m-%d')
                     }
-                    expenses_df = pd.concat([expenses_df, pd.DataFrame([expense_data])], ignore_index=True)
-           
-            save_expense_data(expenses_df)
+                    initial_expenses.append(expense_data)
            
             success, message = register_user(user_data)
             if success:
+                add_expenses(initial_expenses)
                 st.success(message)
                 st.rerun()
             else:
@@ -174,8 +237,11 @@ def show_dashboard():
     st.title(f"Welcome, {st.session_state.current_user}!")
    
     # Getting user data
-    user_data = users_df[users_df['Name'] == st.session_state.current_user].iloc[0]
-    user_expenses = get_user_expenses(expenses_df, st.session_state.current_user)
+    user_data = get_user_record(st.session_state.current_user)
+   
+    # Budget alerts raised by expenses added since the last render
+    for alert in pending_alerts(st.session_state.current_user):
+        st.warning(f"**{alert['section']}** ({alert['time']}): {alert['message']}")
    
     # Sidebar menu
     st.sidebar.title(":red[Menu]")
@@ -183,13 +249,17 @@ def show_dashboard():
     if 'sidebar_option' not in st.session_state:
         st.session_state.sidebar_option = "Dashboard"
    
-    # Sidebar options
+    # Sidebar options (the profiling panel is only offered to admins)
+    is_admin = st.session_state.current_user in PROFILING_ADMINS
     sidebar_option = st.sidebar.radio(
         "Navigate",
-        ["Dashboard", "About Student Spending", "About This App"]
+        ["Dashboard", "About Student Spending", "About This App"] + (["Profiling"] if is_admin else [])
     )
     st.session_state.sidebar_option = sidebar_option
    
+    # Lighter client-side charts instead of server-rendered matplotlib images
+    st.sidebar.checkbox("Lightweight charts", key="light_charts")
+   
     # Logout button
     if st.sidebar.button(":red[Logout]"):
         st.session_state.authenticated = False
@@ -199,122 +269,170 @@ def show_dashboard():
     # Show content based on sidebar selection
     if sidebar_option == "Dashboard":
         # Dashboard tabs
-        tab1, tab2, tab3 = st.tabs(["Expense Analysis", "Optimization Tips", "Add Expenses"])
+        # Only the open tab's content is computed: switching tabs reruns the script
+        tab1, tab2, tab3, tab4 = st.tabs(["Expense Analysis", "Optimization Tips", "Add Expenses", "Expense History"],
+                                   key="dashboard_tab", on_change="rerun")
        
         # Tab 1: Expense Analysis
-        with tab1:
-            st.header(":blue[Expense Analysis]")
+        if tab1.open:
+            with tab1:
+                st.header(":blue[Expense Analysis]")
            
-            # Calculate metrics
-            total_expenses, expense_by_category, income, savings, expense_ratio = calculate_expense_metrics(
-                user_data, user_expenses
-            )
+                # Look up metrics from the user's running totals
+                with span("dashboard.metrics"):
+                    total_expenses, expense_by_category, income, savings, expense_ratio = calculate_expense_metrics(
+                        user_data
+                    )
            
-            # Display key metrics
-            col1, col2, col3, col4 = st.columns(4)
+                # Display key metrics
+                col1, col2, col3, col4 = st.columns(4)
            
-            with col1:
-                st.metric("Total Monthly Expenses", f"₹{int(total_expenses)}")
+                with col1:
+                    st.metric("Total Monthly Expenses", f"₹{int(total_expenses)}")
            
-            with col2:
-                st.metric("Monthly Income", f"₹{int(income)}")
+                with col2:
+                    st.metric("Monthly Income", f"₹{int(income)}")
            
-            with col3:
-                st.metric("Monthly Savings", f"₹{int(savings)}")
+                with col3:
+                    st.metric("Monthly Savings", f"₹{int(savings)}")
            
-            with col4:
-                st.metric("Expense Ratio", f"{expense_ratio:.2f}%")
+                with col4:
+                    st.metric("Expense Ratio", f"{expense_ratio:.2f}%")
            
-            # Expense breakdown charts
-            st.subheader(":violet[Expense Breakdown]")
+                # Date range filter, answered from the monthly/weekly rollups
+                st.subheader(":violet[Spending Over Time]")
+                granularity = st.radio("Group by", ["Month", "Week"], horizontal=True)
+                period = granularity.lower()
+                trend_df = expense_rollup(st.session_state.current_user, period)
+                date_range = None
+                if len(trend_df) > 1:
+                    periods = list(trend_df.index)
+                    start, end = st.select_slider("Date range", options=periods, value=(periods[0], periods[-1]))
+                    if (start, end) != (periods[0], periods[-1]):
+                        date_range = (start, end)
+                        trend_df = trend_df.loc[start:end]
+                        expense_by_category = expense_totals_between(
+                            st.session_state.current_user, start, end, period
+                        )
            
-            col1, col2 = st.columns(2)
+                with span("dashboard.trend_chart"):
+                    if trend_df.empty:
+                        st.info("No dated expenses to show a trend for.")
+                    elif st.session_state.light_charts:
+                        st.bar_chart(trend_df)
+                    else:
+                        st.image(render_trend_chart(
+                            st.session_state.current_user, data_version(st.session_state.current_user),
+                            period, date_range, trend_df
+                        ))
            
-            with col1:
-                # Pie chart
-                if not expense_by_category.empty:
-                    fig, ax = plt.subplots(figsize=(8, 8))
-                    ax.pie(expense_by_category['Amount'], labels=expense_by_category['Category'], autopct='%1.1f%%')
-                    ax.set_title('Expenses by Category')
-                    st.pyplot(fig)
-                   
-                else:
-                    st.info("No expense data available.")
+                # Expense breakdown charts
+                st.subheader(":violet[Expense Breakdown]")
            
-            with col2:
-                # Bar chart
-                if not expense_by_category.empty:
-                    fig, ax = plt.subplots(figsize=(10, 6))
-                    colors = plt.cm.viridis(np.linspace(0, 1, len(expense_by_category)))
-                    bars = ax.bar(expense_by_category['Category'], expense_by_category['Amount'],color=colors)
-                    ax.set_title('Expenses by Category')
-                    ax.set_xlabel('Category')
-                    ax.set_ylabel('Amount (₹)')
-                    plt.xticks(rotation=45, ha='right')
-                    plt.tight_layout()
-                    st.pyplot(fig)
-                else:
-                    st.info("No expense data available.")
+                with span("dashboard.breakdown_charts"):
+                    col1, col2 = st.columns(2)
+           
+                    if expense_by_category.empty:
+                        col1.info("No expense data available.")
+                        col2.info("No expense data available.")
+                    elif st.session_state.light_charts:
+                        # Client-side charts: only the aggregated data is sent to the browser
+                        col1.vega_lite_chart(expense_by_category, {
+                            "mark": {"type": "arc", "tooltip": True},
+                            "encoding": {
+                                "theta": {"field": "Amount", "type": "quantitative"},
+                                "color": {"field": "Category", "type": "nominal"}
+                            }
+                        })
+                        col2.bar_chart(expense_by_category, x='Category', y='Amount')
+                    else:
+                        # Pie and bar charts, re-rendered only when this user's data changes
+                        pie_png, bar_png = render_expense_charts(
+                            st.session_state.current_user, data_version(st.session_state.current_user),
+                            date_range, expense_by_category
+                        )
+                        col1.image(pie_png)
+                        col2.image(bar_png)
            
         # Tab 2: Optimization Tips
-        with tab2:
-            st.subheader(":blue[General Budgeting Guidelines for Students]")
+        if tab2.open:
+            with tab2:
+                st.subheader(":blue[General Budgeting Guidelines for Students]")
            
-            st.write("""
-            ### :violet[50/30/20 Rule]
-            - **50%** of income for necessities (rent, groceries, utilities)
-            - **30%** for wants (dining out, entertainment)
-            - **20%** for savings and debt repayment
+                st.write("""
+                ### :violet[50/30/20 Rule]
+                - **50%** of income for necessities (rent, groceries, utilities)
+                - **30%** for wants (dining out, entertainment)
+                - **20%** for savings and debt repayment
            
            
-            ### :violet[Build an Emergency Fund]
-            - Aim to save 3-6 months of essential expenses
-            - Start small if needed - even $10-20 per week adds up
+                ### :violet[Build an Emergency Fund]
+                - Aim to save 3-6 months of essential expenses
+                - Start small if needed - even $10-20 per week adds up
            
-            ### :violet[ Reduce Recurring Expenses]
-            - Share subscriptions with roommates
-            - Look for student discounts
-            """)
+                ### :violet[ Reduce Recurring Expenses]
+                - Share subscriptions with roommates
+                - Look for student discounts
+                """)
        
         # Tab 3: Add Expenses
-        with tab3:
-            st.header(":blue[Add New Expense]")
+        if tab3.open:
+            with tab3:
+                st.header(":blue[Add New Expense]")
            
-            with st.form("expense_form"):
-                category = st.selectbox(
-                    "Expense Category",
-                    ["Student_Accommodation", "Utilities", "Grocery_shopping",
-                     "Takeaways/dining", "Public_Transportation", "Tuition_Fees",
-                     "Books_and_Supplies", "Clothing", "Entertainment", "Health/Medical_Expenses", "Other"]
-                )
+                with st.form("expense_form"):
+                    category = st.selectbox(
+                        "Expense Category",
+                        ["Student_Accommodation", "Utilities", "Grocery_shopping",
+                         "Takeaways/dining", "Public_Transportation", "Tuition_Fees",
+                         "Books_and_Supplies", "Clothing", "Entertainment", "Health/Medical_Expenses", "Other"]
+                    )
                
-                if category == "Other":
-                    category = st.text_input("Specify Category")
+                    if category == "Other":
+                        category = st.text_input("Specify Category")
                
-                amount = st.number_input("Amount ($)", min_value=0.01, step=1.0)
-                date = st.date_input("Date", datetime.datetime.now())
-                note = st.text_area("Note (Optional)")
+                    amount = st.number_input("Amount ($)", min_value=0.01, step=1.0)
+                    date = st.date_input("Date", datetime.datetime.now())
+                    note = st.text_area("Note (Optional)")
                
-                submitted = st.form_submit_button("Add Expense")
+                    submitted = st.form_submit_button("Add Expense")
                
-                if submitted:
-                    expense_data = {
-                        "Username": st.session_state.current_user,
-                        "Category": category,
-                        "Amount": amount,
-                        "Date": date.strftime('%Y-%m-%d'),
-                        "Note": note
-                    }
+                    if submitted:
+                        expense_data = {
+                            "Username": st.session_state.current_user,
+                            "Category": category,
+                            "Amount": amount,
+                            "Date": date.strftime('%Y-%m-%d'),
+                            "Note": note
+                        }
                    
-                    if add_expense(expense_data):
-                        st.success("Expense added successfully!")
-                        # Update user data with new expense
-                        if category in user_data:
-                            users_df.loc[users_df['Name'] == st.session_state.current_user, category] += amount
-                            save_user_data(users_df)
-                        st.rerun()
-                    else:
-                        st.error("Failed to add expense. Please try again.")
+                        if add_expense(expense_data):
+                            st.success("Expense added successfully!")
+                            # Update user data with new expense
+                            if category in user_data:
+                                update_user_value(st.session_state.current_user, category, amount)
+                            st.rerun()
+                        else:
+                            st.error("Failed to add expense. Please try again.")
+           
+                # Bulk import from a bank statement
+                st.subheader(":violet[Import Expenses]")
+                statement = st.file_uploader("Upload a bank statement (CSV or OFX)", type=["csv", "ofx", "qfx"])
+                debits_negative = st.checkbox("Money spent is shown as negative amounts in this statement")
+                date_order = st.radio("Dates in this statement are written", ["Day first (13/04/2025)",
+                                      "Month first (04/13/2025)"], horizontal=True)
+                if statement is not None and st.button("Import Expenses"):
+                    file_format = "ofx" if statement.name.lower().endswith((".ofx", ".qfx")) else "csv"
+                    summary = import_expenses(statement, username=st.session_state.current_user,
+                                              file_format=file_format, debits_negative=debits_negative,
+                                              dayfirst=date_order.startswith("Day"))
+                    st.success(f"Imported {summary['imported']} expenses ({summary['duplicates']} duplicates, "
+                               f"{summary['credits']} credits and {summary['invalid']} invalid rows skipped)")
+   
+        # Tab 4: Expense History
+        if tab4.open:
+            with tab4:
+                show_expense_history(st.session_state.current_user, user_data)
    
     elif sidebar_option == "About Student Spending":
         st.header(":blue[Average Student Spending Statistics]")
@@ -323,38 +441,25 @@ def show_dashboard():
         st.subheader(":violet[Average Monthly Expenses for College Students]")
        
         # Display average spending data
-        if len(users_df) > 0:
-            expense_categories = [
-                "Student_Accommodation", "Utilities", "Grocery_shopping",
-                "Takeaways/dining", "Public_Transportation", "Tuition_Fees",
-                "Books_and_Supplies", "Clothing", "Entertainment", "Health/Medical_Expenses"
-            ]
-           
-            avg_expenses = {}
-            for category in expense_categories:
-                avg_expenses[category] = users_df[category].mean()
-           
-            # Create a dataframe for visualization
-            avg_expense_df = pd.DataFrame(list(avg_expenses.items()), columns=['Category', 'Average Amount'])
+        if user_count() > 0:
+            # Running population stats (maintained on register/add-expense, no table scan)
+            avg_expense_df = population_statistics()
+            avg_expenses = dict(zip(avg_expense_df['Category'], avg_expense_df['Average Amount']))
            
             # Display data in a table
             st.dataframe(avg_expense_df, use_container_width=True)
            
             # Bar chart for average expenses
-            fig, ax = plt.subplots(figsize=(10, 6))
-            bars = ax.bar(avg_expense_df['Category'], avg_expense_df['Average Amount'],color="teal")
-            ax.set_title('Average Student Expenses by Category')
-            ax.set_xlabel('Category')
-            ax.set_ylabel('Amount ($)')
-            plt.xticks(rotation=45, ha='right')
-            plt.tight_layout()
-            st.pyplot(fig)
+            if st.session_state.light_charts:
+                st.bar_chart(avg_expense_df, x='Category', y='Average Amount')
+            else:
+                st.image(render_average_chart(data_version(), avg_expense_df))
            
             # Show how user compares to average
             st.subheader(":violet[Comaprison with Average]")
            
             comparison_data = []
-            for category in expense_categories:
+            for category in EXPENSE_CATEGORIES:
                 user_amount = user_data[category]
                 avg_amount = avg_expenses[category]
                 diff_percent = ((user_amount - avg_amount) / avg_amount * 100) if avg_amount > 0 else 0
@@ -362,11 +467,22 @@ def show_dashboard():
                     'Category': category,
                     'Your Spending': user_amount,
                     'Average': avg_amount,
-                    'Difference %': diff_percent
+                    'Difference %': diff_percent,
+                    'Percentile Rank': percentile_rank(category, user_amount)
                 })
            
             comparison_df = pd.DataFrame(comparison_data)
             st.dataframe(comparison_df, use_container_width=True)
+           
+            # Benchmarks against the students with the most similar spending mix
+            st.subheader(":violet[Students Like You]")
+            cohort, benchmarks = peer_cohort(st.session_state.current_user)
+            if cohort.empty:
+                st.info("Not enough students to compare with yet.")
+            else:
+                st.caption(f"Compared with the {len(cohort)} students whose spending mix is closest to yours "
+                           f"(average similarity {cohort['Similarity'].mean():.0%})")
+                st.dataframe(benchmarks.round(2), use_container_width=True, hide_index=True)
         else:
             st.info("Not enough data to calculate average student spending.")
        
@@ -410,17 +526,78 @@ def show_dashboard():
         4. **Get Tips**: Find personalized budget optimization advice in the "Optimization Tips" tab
         5. **Compare**: Check how your spending compares to other students
        """)
+   
+    elif sidebar_option == "Profiling" and is_admin:
+        show_profiling_panel()
        
        
 
+def show_expense_history(username, user_data):
+    """Browse the user's expenses a page at a time; filtering and sorting happen server-side"""
+    st.header(":blue[Expense History]")
+   
+    # Categories the user has spent on, from their running totals
+    categories = list(calculate_expense_metrics(user_data)[1]['Category'])
+    col1, col2, col3, col4 = st.columns(4)
+    selected = col1.multiselect("Categories", categories, key="history_categories")
+    dates = col2.date_input("Between", value=[], key="history_dates")
+    min_amount = col3.number_input("Min amount", min_value=0.0, value=None, key="history_min")
+    max_amount = col4.number_input("Max amount", min_value=0.0, value=None, key="history_max")
+   
+    col1, col2, col3 = st.columns(3)
+    sort_by = col1.selectbox("Sort by", HISTORY_SORT_COLUMNS, key="history_sort")
+    descending = col2.toggle("Newest / largest first", value=True, key="history_descending")
+    page_size = col3.selectbox("Rows per page", [25, HISTORY_PAGE_SIZE, 100], index=1, key="history_page_size")
+   
+    filters = dict(sort_by=sort_by, descending=descending, categories=selected,
+                   start=dates[0] if len(dates) > 0 else None, end=dates[1] if len(dates) > 1 else None,
+                   min_amount=min_amount, max_amount=max_amount)
+    _, count = expense_history_page(username, 0, 1, **filters)
+    pages = max((count + page_size - 1) // page_size, 1)
+    if st.session_state.get("history_page", 1) > pages:
+        # Narrower filters can leave fewer pages than the one last viewed
+        st.session_state.history_page = pages
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key="history_page")
+    page_df, count = expense_history_page(username, page - 1, page_size, **filters)
+   
+    if count == 0:
+        st.info("No expenses match these filters.")
+        return
+    first = (page - 1) * page_size
+    st.caption(f"Showing {first + 1}-{first + len(page_df)} of {count} expenses")
+    # Only this page's rows are sent to the browser
+    st.dataframe(page_df[['Date', 'Category', 'Amount', 'Note']], use_container_width=True, hide_index=True)
+
+def show_profiling_panel():
+    """Admin-only view of per-stage timings (p50/p99) with a metrics export"""
+    st.header(":blue[Profiling]")
+   
+    enabled = st.checkbox("Record timings", value=profiling_enabled())
+    if enabled != profiling_enabled():
+        set_profiling(enabled)
+   
+    report = profile_report()
+    if report.empty:
+        st.info("No timings recorded yet. Turn on recording and use the app.")
+    else:
+        st.dataframe(report, use_container_width=True, hide_index=True)
+   
+    col1, col2 = st.columns(2)
+    col1.download_button("Export metrics", export_metrics(), file_name="budget_metrics.json",
+                         mime="application/json")
+    if col2.button("Reset timings"):
+        reset_profile()
+        st.rerun()
+
 # Main application flow
 def main():
-    if st.session_state.authenticated:
-        show_dashboard()
-    elif st.session_state.show_registration:
-        show_registration_page()
-    else:
-        show_login_page()
+    with span("rerun"):
+        if st.session_state.authenticated:
+            show_dashboard()
+        elif st.session_state.show_registration:
+            show_registration_page()
+        else:
+            show_login_page()
 
 if __name__ == "__main__":
     main()
@@ -7,56 +7,2408 @@ Created on Thu May 15 07:40:01 2025
 """
 
 import os
+import io
+import csv
+import json
+import glob
+import shutil
+import time
+import atexit
+import re
+import bisect
+import sqlite3
+import threading
+import contextlib
+import functools
+from collections import Counter, OrderedDict
 import pandas as pd
 import numpy as np
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # only needed for the columnar backend
+    pa = None
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): locks then only cover threads of this process
+    fcntl = None
+
+# Storage backend: 'csv' (default), 'columnar' (memory-mapped Arrow IPC files) or 'sqlite'
+STORAGE_BACKEND = os.environ.get('BUDGET_STORAGE_BACKEND', 'csv')
+
 # File paths
 USERS_FILE = 'users.csv'
 EXPENSES_FILE = 'expenses.csv'
+# New expenses are appended here and merged into EXPENSES_FILE by compaction
+EXPENSES_JOURNAL_FILE = 'expenses.journal.csv'
+# Byte range of each user's rows in EXPENSES_FILE, written by compaction
+EXPENSES_INDEX_FILE = 'expenses.idx.json'
+# update_user_value changes are appended here as (Name, column, delta) rows and
+# applied on top of the users file (csv and columnar); folded in past a size
+USER_DELTAS_FILE = 'users.deltas.csv'
+# Columnar backend files (expenses kept sorted by Username)
+USERS_COLUMNAR_FILE = 'users.arrow'
+EXPENSES_COLUMNAR_FILE = 'expenses.arrow'
+# SQLite backend database (users and expenses tables)
+DATABASE_FILE = os.environ.get('BUDGET_DATABASE_FILE', 'budget.db')
+# Lock files serializing writers across processes (readers never wait on writers for long)
+USERS_LOCK_FILE = 'users.lock'
+EXPENSES_LOCK_FILE = 'expenses.lock'
+COMPACTION_LOCK_FILE = 'expenses.compact.lock'
+
+USER_COLUMNS = [
+    "Name", "Password", "Age", "Gender", "Student_Accommodation",
+    "Utilities", "Grocery_shopping", "Takeaways/dining",
+    "Public_Transportation", "Tuition_Fees", "Books_and_Supplies",
+    "Clothing", "Entertainment", "Health/Medical_Expenses", "Monthly_Income"
+]
+EXPENSE_COLUMNS = ["Username", "Category", "Amount", "Date", "Note"]
+# Per-category monthly amounts stored on each user
+EXPENSE_CATEGORIES = [
+    "Student_Accommodation", "Utilities", "Grocery_shopping",
+    "Takeaways/dining", "Public_Transportation", "Tuition_Fees",
+    "Books_and_Supplies", "Clothing", "Entertainment", "Health/Medical_Expenses"
+]
+
+# Journal tuning
+JOURNAL_FSYNC_BATCH = 32        # fsync after this many appended rows...
+JOURNAL_FSYNC_INTERVAL = 1.0    # ...or once this many seconds have passed
+JOURNAL_COMPACT_ROWS = 10000    # compact in the background past this many rows
+USER_DELTAS_FOLD_BYTES = 1 << 20   # fold the user deltas log into the users file past this size
+
+# Profiling: per-stage call counts and latency sketches, off unless
+# BUDGET_PROFILING=1 (or set_profiling(True)); when off a span costs one dict lookup
+PROFILING_ADMINS = {name for name in os.environ.get('BUDGET_ADMIN_USERS', '').split(',') if name}
+PROFILE_FILE = os.environ.get('BUDGET_PROFILE_FILE')   # metrics written here at exit, if set
+
+_profile_lock = threading.Lock()
+_profile = {'enabled': os.environ.get('BUDGET_PROFILING') == '1', 'stages': {}, 'since': time.time()}
+_NO_SPAN = contextlib.nullcontext()
+
+def set_profiling(enabled):
+    """Turn span recording on or off for this process"""
+    _profile['enabled'] = bool(enabled)
+
+def profiling_enabled():
+    return _profile['enabled']
+
+def reset_profile():
+    """Drop all recorded spans"""
+    with _profile_lock:
+        _profile['stages'] = {}
+        _profile['since'] = time.time()
+
+def _record_span(stage, seconds):
+    with _profile_lock:
+        stats = _profile['stages'].get(stage)
+        if stats is None:
+            stats = _profile['stages'][stage] = {'count': 0, 'total': 0.0, 'max': 0.0, 'sketch': _sketch_new()}
+        stats['count'] += 1
+        stats['total'] += seconds
+        stats['max'] = max(stats['max'], seconds)
+        _sketch_add(stats['sketch'], seconds * 1000)
+
+@contextlib.contextmanager
+def _timed_span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_span(stage, time.perf_counter() - start)
+
+def span(stage):
+    """Context manager timing a named stage (a shared no-op when profiling is off)"""
+    if not _profile['enabled']:
+        return _NO_SPAN
+    return _timed_span(stage)
+
+def profiled(func):
+    """Decorator timing every call of func as a stage named after it"""
+    stage = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _profile['enabled']:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record_span(stage, time.perf_counter() - start)
+    return wrapper
+
+def profile_report():
+    """Calls, total, mean, p50, p99 and max milliseconds per stage, slowest total first"""
+    with _profile_lock:
+        rows = [{
+            'Stage': stage,
+            'Calls': stats['count'],
+            'Total ms': stats['total'] * 1000,
+            'Mean ms': stats['total'] * 1000 / stats['count'],
+            'p50 ms': _sketch_quantile(stats['sketch'], 0.5),
+            'p99 ms': _sketch_quantile(stats['sketch'], 0.99),
+            'Max ms': stats['max'] * 1000,
+        } for stage, stats in _profile['stages'].items()]
+    columns = ['Stage', 'Calls', 'Total ms', 'Mean ms', 'p50 ms', 'p99 ms', 'Max ms']
+    return pd.DataFrame(rows, columns=columns).sort_values('Total ms', ascending=False, ignore_index=True)
+
+def export_metrics(path=None):
+    """Profile report plus latency histograms as JSON; also written to path if given"""
+    with _profile_lock:
+        histograms = {stage: {f"{_bucket_value(bucket):.4g}": count
+                              for bucket, count in sorted(stats['sketch']['buckets'].items())}
+                      for stage, stats in _profile['stages'].items()}
+    metrics = {
+        'since': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(_profile['since'])),
+        'exported': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'stages': profile_report().to_dict(orient='records'),
+        'histograms_ms': histograms,
+    }
+    text = json.dumps(metrics, indent=2, default=float)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text)
+    return text
 
+if PROFILE_FILE:
+    atexit.register(lambda: export_metrics(PROFILE_FILE))
+
+# Inter-process locks: an flock on a lock file plus a per-process RLock, so the
+# same lock can be re-entered by the thread holding it
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+@contextlib.contextmanager
+def _storage_lock(path, shared=False):
+    """Hold the lock file at path, exclusively (writers) or shared (snapshot readers)"""
+    with _file_locks_guard:
+        state = _file_locks.setdefault(path, {'lock': threading.RLock(), 'file': None, 'depth': 0})
+    with state['lock']:
+        # Nested acquisitions keep the mode of the outermost one
+        if state['depth'] == 0 and fcntl is not None:
+            if state['file'] is None:
+                state['file'] = open(path, 'a')
+            fcntl.flock(state['file'].fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        state['depth'] += 1
+        try:
+            yield
+        finally:
+            state['depth'] -= 1
+            if state['depth'] == 0 and fcntl is not None:
+                fcntl.flock(state['file'].fileno(), fcntl.LOCK_UN)
+
+def _atomic_write_csv(frame, path):
+    """Write a dataframe to a temp file and rename it over path, so readers never see a partial file"""
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', newline='') as f:
+        frame.to_csv(f, index=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+def _read_complete_lines(f, offset=0):
+    """Bytes from offset up to the last complete line (a row still being appended is left out)"""
+    f.seek(offset)
+    data = f.read()
+    return data[:data.rfind(b'\n') + 1]
+
+@profiled
 def load_user_data():
-    """Load user data from CSV file or create empty dataframe if file doesn't exist"""
-    if os.path.exists(USERS_FILE):
-        return pd.read_csv(USERS_FILE)
+    """Load user data from storage or create empty dataframe if file doesn't exist"""
+    deltas = []
+    if STORAGE_BACKEND == 'sqlite':
+        users_df, version = _sqlite_read('users', 'SELECT * FROM users ORDER BY rowid')
     else:
+        # The shared lock keeps a fold from swapping the users file and the deltas log between the two reads
+        # (only the raw reads happen under it; parsing is done after)
+        with _storage_lock(USERS_LOCK_FILE, shared=True):
+            if STORAGE_BACKEND == 'columnar':
+                base = _file_signature(USERS_COLUMNAR_FILE)[0]
+                table = _read_columnar(USERS_COLUMNAR_FILE) if base is not None else None
+            elif os.path.exists(USERS_FILE):
+                with open(USERS_FILE, 'rb') as f:
+                    data = _read_complete_lines(f)
+                    base = (os.fstat(f.fileno()).st_ino, len(data))
+            else:
+                data, base = b'', (None, 0)
+            deltas, offset = _read_user_deltas()
+        if STORAGE_BACKEND == 'columnar':
+            users_df = table.to_pandas() if table is not None else None
+        else:
+            users_df = pd.read_csv(io.BytesIO(data)) if data else None
+        version = {'base': base, 'deltas': offset}
+    if users_df is None:
         # Create empty dataframe with required columns
-        columns = [
-            "Name", "Password", "Age", "Gender", "Student_Accommodation",
-            "Utilities", "Grocery_shopping", "Takeaways/dining",
-            "Public_Transportation", "Tuition_Fees", "Books_and_Supplies",
-            "Clothing", "Entertainment", "Health/Medical_Expenses", "Monthly_Income"
-        ]
-        return pd.DataFrame(columns=columns)
-
-def save_user_data(users_df):
-    """Save user data to CSV file"""
-    users_df.to_csv(USERS_FILE, index=False)
-
-def load_expense_data():
-    """Load expense data from CSV file or create empty dataframe if file doesn't exist"""
-    if os.path.exists(EXPENSES_FILE):
-        return pd.read_csv(EXPENSES_FILE)
+        users_df = pd.DataFrame(columns=USER_COLUMNS)
+    users_df = _apply_user_deltas(users_df, deltas)
+    # Version stamp for save_user_data's stale-writer check
+    users_df.attrs['version'] = version
+    return users_df
+
+def _read_user_deltas(offset=None):
+    """(name, column, delta) rows of the deltas log past offset (a (log id, bytes) pair) and the new offset
+
+    Returns None if the log was replaced (by a fold or rewrite) since offset was taken.
+    """
+    try:
+        f = open(USER_DELTAS_FILE, 'rb')
+    except FileNotFoundError:
+        return None if offset is not None and offset[0] is not None else ([], (None, 0))
+    with f:
+        # Logs are told apart by the random id on their first line, not by inode:
+        # a replaced log's inode is free to be reused by the next one
+        header = f.readline()
+        log_id = header[1:].strip().decode() if header.startswith(b'#') else None
+        if offset is not None and offset[0] not in (None, log_id):
+            return None
+        start = offset[1] if offset is not None and offset[0] == log_id else len(header) if log_id else 0
+        data = _read_complete_lines(f, start)
+    rows = [(row[0], row[1], float(row[2])) for row in csv.reader(io.StringIO(data.decode('utf-8'))) if row]
+    return rows, (log_id, start + len(data))
+
+def _apply_user_deltas(users_df, deltas):
+    """Add (name, column, delta) rows to a users dataframe (the first row of a duplicated name)"""
+    if not deltas:
+        return users_df
+    sums = pd.DataFrame(deltas, columns=['Name', 'Column', 'Delta']).groupby(['Column', 'Name'])['Delta'].sum()
+    first = ~users_df['Name'].duplicated()
+    for column, column_sums in sums.groupby(level=0):
+        if column in users_df.columns:
+            added = users_df['Name'].map(column_sums.droplevel(0)).where(first).fillna(0)
+            users_df[column] = pd.to_numeric(users_df[column], errors='coerce') + added
+    return users_df
+
+def _reset_user_deltas(rows=()):
+    """Replace the deltas log with one holding just rows, after the rest went into the users file (caller holds the users lock)
+
+    Returns the offset of the end of the new log.
+    """
+    log_id = os.urandom(8).hex()
+    data = f"#{log_id}\n".encode() + _encode_rows(rows)
+    tmp_file = f"{USER_DELTAS_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    # A new log id tells every reader its offset into the old log is void
+    os.replace(tmp_file, USER_DELTAS_FILE)
+    return log_id, len(data)
+
+@profiled
+def save_user_data(users_df, version=None):
+    """Save user data to storage; False if it was rewritten since users_df was loaded
+
+    Users registered by other sessions since the load (version defaults to the
+    stamp load_user_data left in users_df.attrs) are merged in, not dropped.
+    """
+    if version is None:
+        version = users_df.attrs.get('version')
+    flush_writes()
+    with _storage_lock(USERS_LOCK_FILE):
+        deltas = []
+        if version is not None:
+            appended = _appended_since('users', version)
+            if appended is None:
+                return False
+            appended = appended[~appended['Name'].isin(users_df['Name'])]
+            if len(appended):
+                users_df = pd.concat([users_df, appended], ignore_index=True)
+            if STORAGE_BACKEND != 'sqlite':
+                # Value changes logged since the load are kept too
+                tail = _read_user_deltas(version['deltas'])
+                if tail is None:
+                    return False
+                deltas = tail[0]
+        _write_user_data(_apply_user_deltas(users_df.copy(), deltas))
+        if STORAGE_BACKEND != 'sqlite':
+            _reset_user_deltas()
+    return True
+
+def _write_user_data(users_df):
+    """Replace the stored users (caller holds the users lock)"""
+    if STORAGE_BACKEND == 'sqlite':
+        _sqlite_replace('users', USER_COLUMNS, users_df)
+    elif STORAGE_BACKEND == 'columnar':
+        _write_columnar_users(users_df, USERS_COLUMNAR_FILE)
     else:
-        # Create empty dataframe with required columns
-        columns = ["Username", "Category", "Amount", "Date", "Note"]
-        return pd.DataFrame(columns=columns)
+        _atomic_write_csv(users_df, USERS_FILE)
+
+@profiled
+def load_expense_data(compact=False):
+    """Load expense data from the base file plus any journaled expenses
+
+    With compact=True the rows are converted chunk by chunk into the compact
+    typed form (see compact_expenses), so the full table is never held as strings.
+    """
+    if STORAGE_BACKEND == 'sqlite':
+        expenses_df, version = _sqlite_read(
+            'expenses', 'SELECT Username, Category, Amount, Date, Note FROM expenses ORDER BY id',
+            convert=(lambda chunks: _concat_compact([compact_expenses(chunk) for chunk in chunks])) if compact else None
+        )
+        expenses_df.attrs['version'] = version
+        return expenses_df
+    version = {}
+    base, index, journals = _expense_snapshot(version)
+    frames = []
+    if STORAGE_BACKEND == 'columnar':
+        if base is not None:
+            frames.append(_columnar_expenses_frame(base))
+        expenses_df = _merge_columnar_frames(frames + _read_journals(journals, version))
+        if compact:
+            expenses_df = compact_expenses(expenses_df)
+    elif compact:
+        if base is not None:
+            with base:
+                frames.extend(compact_expenses(chunk) for chunk in pd.read_csv(base, chunksize=COMPACT_CHUNK_ROWS))
+        frames.extend(compact_expenses(journal) for journal in _read_journals(journals, version))
+        expenses_df = _concat_compact(frames)
+    else:
+        if base is not None:
+            with base:
+                frames.append(pd.read_csv(base))
+        frames.extend(_read_journals(journals, version))
+        if not frames:
+            # Create empty dataframe with required columns
+            expenses_df = pd.DataFrame(columns=EXPENSE_COLUMNS)
+        elif len(frames) == 1:
+            expenses_df = frames[0]
+        else:
+            expenses_df = pd.concat(frames, ignore_index=True)
+    # Version stamp for save_expense_data's stale-writer check
+    expenses_df.attrs['version'] = version
+    return expenses_df
+
+@profiled
+def load_user_expenses(username):
+    """Load one user's expenses, reading only their slice of the base file"""
+    if STORAGE_BACKEND == 'sqlite':
+        return _sqlite_query('SELECT Username, Category, Amount, Date, Note FROM expenses '
+                             'WHERE Username = ? ORDER BY id', (username,))
+    base, index, journals = _expense_snapshot()
+    if STORAGE_BACKEND == 'columnar':
+        frames = [_columnar_user_rows(base, username)] if base is not None else []
+        for journal in _read_journals(journals):
+            frames.append(journal[journal['Username'] == username])
+        return _merge_columnar_frames(frames)
+
+    if base is not None and index is None:
+        # Base file has no usable index yet: scan it once and build one in the background
+        _start_compaction()
+        with base:
+            frames = [pd.read_csv(base)]
+        frames.extend(_read_journals(journals))
+        return get_user_expenses(pd.concat(frames, ignore_index=True), username)
+
+    frames = []
+    if base is not None:
+        with base:
+            span = index.get(username)
+            if span is not None:
+                base.seek(span[0])
+                chunk = base.read(span[1] - span[0])
+                frames.append(pd.read_csv(io.BytesIO(chunk), header=None, names=EXPENSE_COLUMNS))
+    for journal in _read_journals(journals):
+        frames.append(journal[journal['Username'] == username])
+    if not frames:
+        return pd.DataFrame(columns=EXPENSE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+@profiled
+def save_expense_data(expenses_df, version=None):
+    """Save expense data to storage (full rewrite, use append_expenses for new rows)
+
+    Expenses appended by other sessions since expenses_df was loaded are merged
+    in. Returns False without writing if the store was rewritten or compacted in
+    the meantime, so the caller can reload and retry.
+    """
+    if version is None:
+        version = expenses_df.attrs.get('version')
+    if _is_compact(expenses_df):
+        expenses_df = expand_expenses(expenses_df)
+    flush_writes()
+    # Compaction also rewrites the base file, so keep it out while we do
+    with _storage_lock(COMPACTION_LOCK_FILE), _storage_lock(EXPENSES_LOCK_FILE), _journal_lock:
+        if version is not None:
+            appended = _appended_since('expenses', version)
+            if appended is None:
+                return False
+            if len(appended):
+                expenses_df = pd.concat([expenses_df, appended], ignore_index=True)
+        if STORAGE_BACKEND == 'sqlite':
+            _sqlite_replace('expenses', EXPENSE_COLUMNS, expenses_df)
+            return True
+        _close_journal()
+        if STORAGE_BACKEND == 'columnar':
+            _write_columnar_expenses(expenses_df, EXPENSES_COLUMNAR_FILE)
+        else:
+            _atomic_write_csv(expenses_df, EXPENSES_FILE)
+        # The rewritten base file already contains everything journaled so far,
+        # but is no longer sorted by user
+        for path in _journal_segments() + [EXPENSES_JOURNAL_FILE, EXPENSES_INDEX_FILE]:
+            if os.path.exists(path):
+                os.remove(path)
+        _journal_state['rows'] = 0
+    return True
+
+def _appended_since(table, version):
+    """Rows appended to 'users' or 'expenses' after version was stamped, None if it was rewritten since"""
+    if STORAGE_BACKEND == 'sqlite':
+        return _sqlite_appended_since(table, version)
+    if table == 'users':
+        version = version['base']
+        if STORAGE_BACKEND == 'columnar':
+            # Arrow files are only ever rewritten whole
+            return pd.DataFrame(columns=USER_COLUMNS) if _file_signature(USERS_COLUMNAR_FILE)[0] == version else None
+        inode, size = version
+        try:
+            f = open(USERS_FILE, 'rb')
+        except FileNotFoundError:
+            return pd.DataFrame(columns=USER_COLUMNS) if inode is None else None
+        with f:
+            if inode is None:
+                data = _read_complete_lines(f)
+                return pd.read_csv(io.BytesIO(data)) if data else pd.DataFrame(columns=USER_COLUMNS)
+            if os.fstat(f.fileno()).st_ino != inode:
+                return None
+            data = _read_complete_lines(f, size)
+        if not data.strip():
+            return pd.DataFrame(columns=USER_COLUMNS)
+        return pd.read_csv(io.BytesIO(data), header=None, names=USER_COLUMNS)
+
+    # Expenses: the base file must be untouched; journals are matched by inode so
+    # a journal rotated into a segment still counts from where the stamp left off
+    current = {}
+    base, index, journals = _expense_snapshot(current)
+    if base is not None and STORAGE_BACKEND != 'columnar':
+        base.close()
+    if current['base'] != version.get('base'):
+        for journal in journals:
+            journal.close()
+        return None
+    frames = []
+    for journal in journals:
+        with journal:
+            data = _read_complete_lines(journal, version['journals'].get(os.fstat(journal.fileno()).st_ino, 0))
+        if data:
+            frames.append(pd.read_csv(io.BytesIO(data), header=None, names=EXPENSE_COLUMNS))
+    if not frames:
+        return pd.DataFrame(columns=EXPENSE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+_index_cache = {'key': None, 'users': None}
+
+def _load_expense_index():
+    """Return {username: [start, end]} byte ranges into EXPENSES_FILE, or None if missing/stale"""
+    try:
+        stat = os.stat(EXPENSES_INDEX_FILE)
+        key = (stat.st_mtime_ns, stat.st_size)
+        if _index_cache['key'] != key:
+            with open(EXPENSES_INDEX_FILE) as f:
+                index = json.load(f)
+            _index_cache['key'], _index_cache['users'] = key, index
+        index = _index_cache['users']
+        # A base file rewritten behind the index's back invalidates it
+        if os.path.getsize(EXPENSES_FILE) != index['size']:
+            return None
+        return index['users']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _expense_snapshot(version=None):
+    """Open the base file, its index and the journal files as one consistent snapshot
+
+    If a version dict is given, the base file's signature is recorded in it.
+    """
+    # Open handles keep reading the old files even if compaction swaps them out
+    # afterwards; the shared lock only keeps a swap from landing mid-snapshot
+    with _storage_lock(EXPENSES_LOCK_FILE, shared=True):
+        if STORAGE_BACKEND == 'columnar':
+            base = _read_columnar(EXPENSES_COLUMNAR_FILE) if os.path.exists(EXPENSES_COLUMNAR_FILE) else None
+            index = None
+        else:
+            base = open(EXPENSES_FILE, 'rb') if os.path.exists(EXPENSES_FILE) else None
+            index = _load_expense_index() if base is not None else None
+        journals = [open(path, 'rb') for path in _journal_segments() + [EXPENSES_JOURNAL_FILE]
+                    if os.path.exists(path)]
+        if version is not None:
+            version['base'] = _file_signature(EXPENSES_COLUMNAR_FILE if STORAGE_BACKEND == 'columnar'
+                                              else EXPENSES_FILE)[0]
+            version['journals'] = {}
+    return base, index, journals
+
+def _read_journals(journals, version=None):
+    """Parse open journal files into dataframes, closing them (bytes read per inode go into version)"""
+    frames = []
+    for journal in journals:
+        with journal:
+            # Ignore a trailing row that is still being written
+            data = _read_complete_lines(journal)
+            if version is not None:
+                version['journals'][os.fstat(journal.fileno()).st_ino] = len(data)
+        if data:
+            frames.append(pd.read_csv(io.BytesIO(data), header=None, names=EXPENSE_COLUMNS))
+    return frames
+
+# Append-only expense journal
+_journal_lock = threading.Lock()
+_journal_state = {'file': None, 'rows': None, 'unsynced': 0, 'last_sync': 0.0,
+                  'sync_timer': None, 'compacting': False, 'compaction': None}
+
+def _journal_segments():
+    """Return journal segments waiting to be merged, oldest first"""
+    root, ext = os.path.splitext(EXPENSES_JOURNAL_FILE)
+    segments = glob.glob(f"{root}.*{ext}")
+    return sorted(segments, key=lambda path: int(path[len(root) + 1:-len(ext)]))
+
+def _journal_row(expense_data):
+    """Order an expense dict by EXPENSE_COLUMNS, blank for missing fields"""
+    return _journal_row_for(expense_data, EXPENSE_COLUMNS)
+
+def _journal_row_for(record, columns):
+    """Order a dict by columns, blank for missing fields"""
+    row = []
+    for column in columns:
+        value = record.get(column)
+        row.append('' if value is None else value)
+    return row
+
+def _encode_rows(rows):
+    """Format rows as CSV bytes"""
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue().encode()
+
+def _close_journal():
+    """Fsync and close the open journal file (caller holds _journal_lock)"""
+    journal = _journal_state['file']
+    if journal is not None:
+        journal.flush()
+        os.fsync(journal.fileno())
+        journal.close()
+        _journal_state['file'] = None
+        _journal_state['unsynced'] = 0
+
+def append_expenses(expenses):
+    """Append expense dicts to the journal without rewriting the expenses file"""
+    if not expenses:
+        return
+    if STORAGE_BACKEND == 'sqlite':
+        # SQLite's own WAL plays the journal's role
+        _sqlite_insert('expenses', EXPENSE_COLUMNS, expenses)
+        return
+    with _storage_lock(EXPENSES_LOCK_FILE), _journal_lock:
+        if _journal_state['file'] is not None and not _is_live_journal(_journal_state['file']):
+            # Another process rotated or removed the journal under our open handle
+            _close_journal()
+            _journal_state['rows'] = None
+        if _journal_state['file'] is None:
+            _journal_state['file'] = open(EXPENSES_JOURNAL_FILE, 'ab')
+            _journal_state['last_sync'] = time.monotonic()
+        if _journal_state['rows'] is None:
+            _journal_state['rows'] = _count_journal_rows()
+        journal = _journal_state['file']
+        journal.write(_encode_rows(_journal_row(expense) for expense in expenses))
+        journal.flush()
+
+        # Batch fsyncs: the rows are already visible to readers after flush()
+        _journal_state['unsynced'] += len(expenses)
+        _journal_state['rows'] += len(expenses)
+        now = time.monotonic()
+        if (_journal_state['unsynced'] >= JOURNAL_FSYNC_BATCH
+                or now - _journal_state['last_sync'] >= JOURNAL_FSYNC_INTERVAL):
+            os.fsync(journal.fileno())
+            _journal_state['unsynced'] = 0
+            _journal_state['last_sync'] = now
+        elif _journal_state['sync_timer'] is None:
+            # The rows left unsynced still reach disk within the interval if no append follows
+            delay = _journal_state['last_sync'] + JOURNAL_FSYNC_INTERVAL - now
+            timer = threading.Timer(delay, flush_expense_journal)
+            timer.daemon = True
+            _journal_state['sync_timer'] = timer
+            timer.start()
+
+        if _journal_state['rows'] >= JOURNAL_COMPACT_ROWS:
+            _start_compaction()
+
+def _is_live_journal(journal):
+    """Whether an open journal handle is still the file at EXPENSES_JOURNAL_FILE"""
+    try:
+        return os.stat(EXPENSES_JOURNAL_FILE).st_ino == os.fstat(journal.fileno()).st_ino
+    except OSError:
+        return False
+
+def append_expense(expense_data):
+    """Append a single expense to the journal"""
+    append_expenses([expense_data])
+
+def flush_expense_journal():
+    """Force any batched journal writes to disk"""
+    with _journal_lock:
+        _journal_state['sync_timer'] = None
+        journal = _journal_state['file']
+        if journal is not None and _journal_state['unsynced']:
+            os.fsync(journal.fileno())
+            _journal_state['unsynced'] = 0
+            _journal_state['last_sync'] = time.monotonic()
+
+atexit.register(flush_expense_journal)
+
+def _count_journal_rows():
+    """Count rows sitting in the journal and its segments"""
+    rows = 0
+    for path in _journal_segments() + [EXPENSES_JOURNAL_FILE]:
+        if os.path.exists(path):
+            with open(path, newline='') as f:
+                rows += sum(1 for _ in csv.reader(f))
+    return rows
+
+def _start_compaction():
+    """Run compact_expense_journal on a background thread unless one is already running"""
+    if not _journal_state['compacting']:
+        _journal_state['compacting'] = True
+        _journal_state['compaction'] = threading.Thread(target=compact_expense_journal, daemon=True)
+        _journal_state['compaction'].start()
+
+def _wait_for_compaction():
+    """Let a background compaction finish before the process exits"""
+    # Killed between swapping in the new base file and removing the merged
+    # segments, it would leave rows that the next compaction merges again
+    thread = _journal_state['compaction']
+    if thread is not None:
+        thread.join()
+
+# Registered before flush_writes, so it also waits for a compaction started by the final flush
+atexit.register(_wait_for_compaction)
 
-def save_expense_data(expenses_df):
-    """Save expense data to CSV file"""
-    expenses_df.to_csv(EXPENSES_FILE, index=False)
+def _copy_range(src, dst, length, chunk_size=1 << 20):
+    """Copy length bytes from the current position of src to dst"""
+    while length > 0:
+        chunk = src.read(min(chunk_size, length))
+        if not chunk:
+            break
+        dst.write(chunk)
+        length -= len(chunk)
 
+@profiled
+def compact_expense_journal(backend=None):
+    """Merge journal segments into the base expenses file, kept sorted by user with an offset index"""
+    backend = backend or STORAGE_BACKEND
+    if backend == 'sqlite':
+        return
+    with _storage_lock(COMPACTION_LOCK_FILE):
+        try:
+            # Rotate the live journal into a numbered segment so appends continue meanwhile
+            with _storage_lock(EXPENSES_LOCK_FILE), _journal_lock:
+                _close_journal()
+                segments = _journal_segments()
+                if os.path.exists(EXPENSES_JOURNAL_FILE) and os.path.getsize(EXPENSES_JOURNAL_FILE) > 0:
+                    root, ext = os.path.splitext(EXPENSES_JOURNAL_FILE)
+                    number = int(segments[-1][len(root) + 1:-len(ext)]) + 1 if segments else 0
+                    segment = f"{root}.{number}{ext}"
+                    os.replace(EXPENSES_JOURNAL_FILE, segment)
+                    segments.append(segment)
+                _journal_state['rows'] = 0
+            if backend == 'columnar':
+                _compact_columnar(segments)
+                return
+            index = _load_expense_index() if os.path.exists(EXPENSES_FILE) else None
+            if not segments and (index is not None or not os.path.exists(EXPENSES_FILE)):
+                return
+
+            # Journal rows grouped by user, in insertion order
+            new_rows = {}
+            for segment in segments:
+                with open(segment, newline='') as f:
+                    for row in csv.reader(f):
+                        if row:
+                            new_rows.setdefault(row[0], []).append(row)
+
+            base_ranges = index or {}
+            if index is None and os.path.exists(EXPENSES_FILE):
+                # Base file predates the index: group its rows once so it can be sorted
+                with open(EXPENSES_FILE, newline='') as f:
+                    reader = csv.reader(f)
+                    next(reader, None)
+                    base_rows = {}
+                    for row in reader:
+                        if row:
+                            base_rows.setdefault(row[0], []).append(row)
+                for username, rows in new_rows.items():
+                    base_rows.setdefault(username, []).extend(rows)
+                new_rows = base_rows
+
+            # Write users in sorted order: their existing byte range, then their new rows
+            users_index = {}
+            tmp_file = EXPENSES_FILE + '.tmp'
+            with open(tmp_file, 'wb') as out:
+                out.write((','.join(EXPENSE_COLUMNS) + '\n').encode())
+                base = open(EXPENSES_FILE, 'rb') if base_ranges else None
+                try:
+                    for username in sorted(set(base_ranges) | set(new_rows)):
+                        start = out.tell()
+                        if username in base_ranges:
+                            base.seek(base_ranges[username][0])
+                            _copy_range(base, out, base_ranges[username][1] - base_ranges[username][0])
+                        if username in new_rows:
+                            out.write(_encode_rows(new_rows[username]))
+                        users_index[username] = [start, out.tell()]
+                finally:
+                    if base is not None:
+                        base.close()
+                out.flush()
+                os.fsync(out.fileno())
+                size = out.tell()
+            with open(EXPENSES_INDEX_FILE + '.tmp', 'w') as f:
+                json.dump({'size': size, 'users': users_index}, f)
+
+            # Swap base, index and segments together so readers never see a mix
+            with _storage_lock(EXPENSES_LOCK_FILE):
+                os.replace(tmp_file, EXPENSES_FILE)
+                os.replace(EXPENSES_INDEX_FILE + '.tmp', EXPENSES_INDEX_FILE)
+                for segment in segments:
+                    os.remove(segment)
+        finally:
+            _journal_state['compacting'] = False
+
+# Columnar storage backend
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("The columnar storage backend requires pyarrow (pip install pyarrow)")
+
+def _read_columnar(path):
+    """Memory-map an Arrow IPC file; column buffers are read zero-copy from the page cache"""
+    _require_pyarrow()
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+def _write_table(table, path):
+    """Write an Arrow table to path atomically as a single record batch"""
+    tmp_file = path + '.tmp'
+    with pa.OSFile(tmp_file, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table.combine_chunks())
+    os.replace(tmp_file, path)
+
+def _dictionary_array(values):
+    """Dictionary-encode strings with a sorted dictionary"""
+    categorical = pd.Categorical(values.fillna('').astype(str))
+    return pa.DictionaryArray.from_arrays(
+        pa.array(categorical.codes.astype(np.int32)),
+        pa.array(categorical.categories.astype(str), type=pa.string())
+    )
+
+def _write_columnar_users(users_df, path):
+    """Write the users table with typed columns"""
+    _require_pyarrow()
+    users_df = users_df.reset_index(drop=True)
+    columns = {
+        "Name": pa.array(users_df["Name"].astype('string'), type=pa.string(), from_pandas=True),
+        "Password": pa.array(users_df["Password"].astype('string'), type=pa.string(), from_pandas=True),
+        # Missing or unparseable values are stored as nulls, as the CSV and SQLite backends accept them
+        "Age": pa.array(pd.to_numeric(users_df["Age"], errors='coerce').round().astype('Int64'),
+                        type=pa.int64(), from_pandas=True),
+        "Gender": _dictionary_array(users_df["Gender"]),
+    }
+    for column in USER_COLUMNS[4:]:
+        columns[column] = pa.array(pd.to_numeric(users_df[column], errors='coerce').astype(np.float64))
+    _write_table(pa.table(columns), path)
+
+def _write_columnar_expenses(expenses_df, path):
+    """Write expenses sorted by user: dictionary-encoded Username/Category, date32 Date, float Amount"""
+    _require_pyarrow()
+    expenses_df = expenses_df.reset_index(drop=True)
+    usernames = _dictionary_array(expenses_df['Username'])
+    # Sorted dictionary + stable sort on codes keeps each user's rows contiguous and in order
+    order = np.argsort(usernames.indices.to_numpy(), kind='stable')
+    dates = pd.to_datetime(expenses_df['Date'], errors='coerce').to_numpy().astype('datetime64[D]')
+    table = pa.table({
+        'Username': usernames,
+        'Category': _dictionary_array(expenses_df['Category']),
+        'Amount': pa.array(pd.to_numeric(expenses_df['Amount']).astype(np.float64)),
+        'Date': pa.array(dates, type=pa.date32()),
+        'Note': pa.array(expenses_df['Note'].astype('string'), type=pa.string(), from_pandas=True),
+    }).take(pa.array(order))
+    _write_table(table, path)
+
+def _columnar_expenses_frame(table):
+    """Convert an expenses table to pandas (categoricals for dictionary columns, datetime Date)"""
+    return table.to_pandas(date_as_object=False)
+
+def _columnar_user_rows(table, username):
+    """Slice one user's rows out of the sorted, memory-mapped expenses table"""
+    usernames = table.column('Username').chunk(0) if table.num_rows else None
+    if usernames is None:
+        return _columnar_expenses_frame(table)
+    # Binary search the sorted dictionary, then the (sorted) codes
+    dictionary = usernames.dictionary
+    code = bisect.bisect_left(dictionary, username, key=lambda value: value.as_py())
+    if code == len(dictionary) or dictionary[code].as_py() != username:
+        return _columnar_expenses_frame(table.slice(0, 0))
+    codes = usernames.indices.to_numpy(zero_copy_only=True)
+    start = np.searchsorted(codes, code, side='left')
+    stop = np.searchsorted(codes, code, side='right')
+    return _columnar_expenses_frame(table.slice(start, stop - start))
+
+def _merge_columnar_frames(frames):
+    """Concatenate columnar and journal frames, restoring the columnar dtypes"""
+    if not frames:
+        return pd.DataFrame(columns=EXPENSE_COLUMNS)
+    if len(frames) == 1 and isinstance(frames[0]['Username'].dtype, pd.CategoricalDtype):
+        return frames[0]
+    expenses_df = pd.concat(frames, ignore_index=True)
+    expenses_df['Username'] = expenses_df['Username'].astype('category')
+    expenses_df['Category'] = expenses_df['Category'].astype('category')
+    expenses_df['Date'] = pd.to_datetime(expenses_df['Date'], errors='coerce')
+    return expenses_df
+
+def _compact_columnar(segments):
+    """Rewrite the columnar expenses file with the journal segments folded in"""
+    if not segments:
+        return
+    frames = []
+    if os.path.exists(EXPENSES_COLUMNAR_FILE):
+        frames.append(_columnar_expenses_frame(_read_columnar(EXPENSES_COLUMNAR_FILE)))
+    for segment in segments:
+        frames.append(pd.read_csv(segment, header=None, names=EXPENSE_COLUMNS))
+    expenses_df = _merge_columnar_frames(frames)
+    tmp_file = EXPENSES_COLUMNAR_FILE + '.compact'
+    _write_columnar_expenses(expenses_df, tmp_file)
+    with _storage_lock(EXPENSES_LOCK_FILE):
+        os.replace(tmp_file, EXPENSES_COLUMNAR_FILE)
+        for segment in segments:
+            os.remove(segment)
+
+def migrate_csv_to_columnar():
+    """One-shot migration of users.csv/expenses.csv (and pending journal rows) to the columnar files"""
+    # Fold the journal into expenses.csv first so both stores hold the same rows afterwards
+    compact_expense_journal(backend='csv')
+    users_df = pd.read_csv(USERS_FILE) if os.path.exists(USERS_FILE) else pd.DataFrame(columns=USER_COLUMNS)
+    expenses_df = pd.read_csv(EXPENSES_FILE) if os.path.exists(EXPENSES_FILE) else pd.DataFrame(columns=EXPENSE_COLUMNS)
+    _write_columnar_users(users_df, USERS_COLUMNAR_FILE)
+    _write_columnar_expenses(expenses_df, EXPENSES_COLUMNAR_FILE)
+    return len(users_df), len(expenses_df)
+
+def export_columnar_to_csv(users_path=None, expenses_path=None):
+    """Export the columnar files (and pending journal rows) to CSV"""
+    users_path = users_path or USERS_FILE
+    expenses_path = expenses_path or EXPENSES_FILE
+    compact_expense_journal(backend='columnar')
+    users_df = _read_columnar(USERS_COLUMNAR_FILE).to_pandas() if os.path.exists(USERS_COLUMNAR_FILE) else pd.DataFrame(columns=USER_COLUMNS)
+    if os.path.abspath(users_path) != os.path.abspath(USERS_FILE):
+        # The deltas log is shared by users.csv and users.arrow; other files get it applied
+        users_df = _apply_user_deltas(users_df, _read_user_deltas()[0])
+    if os.path.exists(EXPENSES_COLUMNAR_FILE):
+        expenses_df = _columnar_expenses_frame(_read_columnar(EXPENSES_COLUMNAR_FILE))
+        expenses_df['Date'] = expenses_df['Date'].dt.strftime('%Y-%m-%d')
+    else:
+        expenses_df = pd.DataFrame(columns=EXPENSE_COLUMNS)
+    with _storage_lock(USERS_LOCK_FILE):
+        _atomic_write_csv(users_df, users_path)
+    with _storage_lock(COMPACTION_LOCK_FILE), _storage_lock(EXPENSES_LOCK_FILE):
+        _atomic_write_csv(expenses_df, expenses_path)
+        if os.path.abspath(expenses_path) == os.path.abspath(EXPENSES_FILE) and os.path.exists(EXPENSES_INDEX_FILE):
+            # Rows are sorted by user but the byte offsets changed; compaction rebuilds the index
+            os.remove(EXPENSES_INDEX_FILE)
+    return len(users_df), len(expenses_df)
+
+# SQLite storage backend: writes share one connection under _db_lock, reads use
+# a connection per thread so that sessions read concurrently (WAL readers)
+_db_lock = threading.RLock()
+_db_state = {'connection': None, 'path': None}
+_db_readers = threading.local()
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+def _sqlite_value(value):
+    """Plain Python value for sqlite3 (NumPy scalars unwrapped, NaN/'' as NULL)"""
+    if hasattr(value, 'item'):
+        value = value.item()
+    if value is None or value == '' or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value
+
+def _db():
+    """Shared write connection to DATABASE_FILE (WAL mode, schema created on first use); hold _db_lock"""
+    if _db_state['connection'] is None or _db_state['path'] != DATABASE_FILE:
+        connection = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        user_columns = ', '.join(
+            f"{_quote(column)} {'TEXT' if column in ('Name', 'Password', 'Gender') else 'INTEGER' if column == 'Age' else 'REAL'}"
+            for column in USER_COLUMNS
+        )
+        with connection:
+            connection.execute(f'CREATE TABLE IF NOT EXISTS users ({user_columns})')
+            connection.execute('CREATE INDEX IF NOT EXISTS users_name ON users (Name)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS expenses (id INTEGER PRIMARY KEY, '
+                'Username TEXT, Category TEXT, Amount REAL, Date TEXT, Note TEXT)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS expenses_user_date ON expenses (Username, Date)')
+            connection.execute('CREATE INDEX IF NOT EXISTS expenses_user_category ON expenses (Username, Category)')
+            # Bumped by every write that isn't a plain append (rewrites, in-place updates)
+            connection.execute('CREATE TABLE IF NOT EXISTS generations (name TEXT PRIMARY KEY, generation INTEGER)')
+        _db_state['connection'], _db_state['path'] = connection, DATABASE_FILE
+    return _db_state['connection']
+
+def _db_reader():
+    """This thread's read-only connection to DATABASE_FILE (no lock needed)"""
+    if getattr(_db_readers, 'path', None) != DATABASE_FILE:
+        with _db_lock:
+            # The write connection creates the schema
+            _db()
+        connection = sqlite3.connect(DATABASE_FILE)
+        connection.execute('PRAGMA query_only=ON')
+        _db_readers.connection, _db_readers.path = connection, DATABASE_FILE
+    return _db_readers.connection
+
+def _sqlite_signature():
+    """Changes whenever another connection commits to the database"""
+    # Taken on the write connection: data_version counts are per connection,
+    # and this one's don't move on our own commits
+    with _db_lock:
+        return ('sqlite', _db().execute('PRAGMA data_version').fetchone()[0])
+
+def _sqlite_bump_generation(connection, table):
+    connection.execute('INSERT INTO generations VALUES (?, 1) '
+                       'ON CONFLICT (name) DO UPDATE SET generation = generation + 1', (table,))
+
+def _sqlite_version(connection, table):
+    """(generation, last rowid) of a table: appends only move the rowid"""
+    generation = connection.execute('SELECT generation FROM generations WHERE name = ?', (table,)).fetchone()
+    last = connection.execute(f'SELECT MAX(rowid) FROM {table}').fetchone()[0]
+    return (generation[0] if generation else 0, last or 0)
+
+def _sqlite_read(table, query, params=(), convert=None):
+    """Run a query and stamp the table's version in one read transaction
+
+    convert, if given, receives the result as an iterator of chunks and returns the frame.
+    """
+    connection = _db_reader()
+    connection.execute('BEGIN')
+    try:
+        if convert is None:
+            frame = pd.read_sql_query(query, connection, params=params)
+        else:
+            frame = convert(pd.read_sql_query(query, connection, params=params, chunksize=COMPACT_CHUNK_ROWS))
+        version = _sqlite_version(connection, table)
+    finally:
+        connection.execute('COMMIT')
+    return frame, version
+
+def _sqlite_appended_since(table, version):
+    """Rows inserted after version, None if the table was rewritten or updated since"""
+    columns = USER_COLUMNS if table == 'users' else EXPENSE_COLUMNS
+    with _db_lock:
+        connection = _db()
+        connection.execute('BEGIN')
+        try:
+            generation, last = version
+            if _sqlite_version(connection, table)[0] != generation:
+                return None
+            return pd.read_sql_query(
+                f"SELECT {', '.join(_quote(column) for column in columns)} FROM {table} "
+                f"WHERE rowid > ? ORDER BY rowid", connection, params=(last,)
+            )
+        finally:
+            connection.execute('COMMIT')
+
+def _sqlite_insert(table, columns, records):
+    """Batched insert of dicts with one prepared statement in one transaction"""
+    placeholders = ', '.join('?' for _ in columns)
+    statement = f"INSERT INTO {table} ({', '.join(_quote(column) for column in columns)}) VALUES ({placeholders})"
+    rows = ([_sqlite_value(record.get(column)) for column in columns] for record in records)
+    with _db_lock:
+        connection = _db()
+        with connection:
+            connection.executemany(statement, rows)
+
+def _sqlite_replace(table, columns, frame):
+    """Replace a table's contents with a dataframe in one transaction"""
+    with _db_lock:
+        connection = _db()
+        with connection:
+            connection.execute(f'DELETE FROM {table}')
+            _sqlite_bump_generation(connection, table)
+            placeholders = ', '.join('?' for _ in columns)
+            statement = f"INSERT INTO {table} ({', '.join(_quote(column) for column in columns)}) VALUES ({placeholders})"
+            values = frame.reindex(columns=columns).astype(object)
+            connection.executemany(statement, ([_sqlite_value(value) for value in row]
+                                               for row in values.itertuples(index=False, name=None)))
+
+def _sqlite_query(query, params=()):
+    return pd.read_sql_query(query, _db_reader(), params=params)
+
+def _sqlite_aggregate(username):
+    """Per-user totals computed by SQL GROUP BY on the (Username, ...) indexes"""
+    connection = _db_reader()
+    # One read transaction, so the three queries see the same rows
+    connection.execute('BEGIN')
+    try:
+        by_category = connection.execute(
+            'SELECT Category, SUM(Amount), COUNT(*) FROM expenses WHERE Username = ? GROUP BY Category',
+            (username,)
+        ).fetchall()
+        by_month = connection.execute(
+            'SELECT substr(Date, 1, 7), SUM(Amount) FROM expenses '
+            'WHERE Username = ? AND Date IS NOT NULL GROUP BY substr(Date, 1, 7)',
+            (username,)
+        ).fetchall()
+        # Daily totals per category are enough to fill the month and week rollups
+        by_day = pd.read_sql_query(
+            'SELECT Category, Date, SUM(Amount) AS Amount FROM expenses '
+            'WHERE Username = ? AND Date IS NOT NULL AND Category IS NOT NULL GROUP BY Category, Date',
+            connection, params=(username,)
+        )
+    finally:
+        connection.execute('COMMIT')
+    rollup = _rollup_new()
+    days, dated = _day_numbers(by_day['Date'])
+    _rollup_add(rollup, by_day['Category'].to_numpy(dtype=object)[dated], days,
+                by_day['Amount'].fillna(0).to_numpy()[dated])
+    return {
+        'total': float(sum(total or 0 for _, total, _ in by_category)),
+        'count': sum(count for _, _, count in by_category),
+        'by_category': {category: float(total or 0) for category, total, _ in by_category if category is not None},
+        'by_month': {month: float(total or 0) for month, total in by_month},
+        'rollup': rollup,
+    }
+
+def migrate_csv_to_sqlite():
+    """One-shot migration of users.csv/expenses.csv (and pending journal rows) into DATABASE_FILE"""
+    compact_expense_journal(backend='csv')
+    users_df = pd.read_csv(USERS_FILE) if os.path.exists(USERS_FILE) else pd.DataFrame(columns=USER_COLUMNS)
+    users_df = _apply_user_deltas(users_df, _read_user_deltas()[0])
+    expenses_df = pd.read_csv(EXPENSES_FILE) if os.path.exists(EXPENSES_FILE) else pd.DataFrame(columns=EXPENSE_COLUMNS)
+    _sqlite_replace('users', USER_COLUMNS, users_df)
+    _sqlite_replace('expenses', EXPENSE_COLUMNS, expenses_df)
+    return len(users_df), len(expenses_df)
+
+def export_sqlite_to_csv(users_path=None, expenses_path=None):
+    """Export DATABASE_FILE to CSV"""
+    users_path = users_path or USERS_FILE
+    expenses_path = expenses_path or EXPENSES_FILE
+    users_df = _sqlite_query('SELECT * FROM users ORDER BY rowid')
+    expenses_df = _sqlite_query('SELECT Username, Category, Amount, Date, Note FROM expenses ORDER BY id')
+    with _storage_lock(USERS_LOCK_FILE):
+        _atomic_write_csv(users_df, users_path)
+        if os.path.abspath(users_path) == os.path.abspath(USERS_FILE):
+            # The exported values already include every change; the log no longer applies
+            _reset_user_deltas()
+    with _storage_lock(COMPACTION_LOCK_FILE), _storage_lock(EXPENSES_LOCK_FILE):
+        _atomic_write_csv(expenses_df, expenses_path)
+        if os.path.abspath(expenses_path) == os.path.abspath(EXPENSES_FILE) and os.path.exists(EXPENSES_INDEX_FILE):
+            os.remove(EXPENSES_INDEX_FILE)
+    return len(users_df), len(expenses_df)
+
+# Compact in-memory expenses: category codes for Username, Category and Note
+# (each distinct string stored once), int32 day numbers for Date and int64
+# paise for Amount -- about 16-20 bytes a row instead of 75-250
+COMPACT_CHUNK_ROWS = 100000     # rows converted at a time while loading
+MISSING_DAY = np.iinfo(np.int32).min
+
+def _is_compact(expenses_df):
+    return 'Date' in expenses_df.columns and expenses_df['Date'].dtype == np.int32
+
+def _string_codes(values):
+    """Categorical of the values as strings with object categories (missing values stay NaN)"""
+    values = pd.Series(values).reset_index(drop=True)
+    present = values.notna().to_numpy()
+    codes, uniques = pd.factorize(values[present].astype(str).to_numpy(dtype=object))
+    all_codes = np.full(len(values), -1, dtype=np.int32)
+    all_codes[present] = codes
+    return pd.Categorical.from_codes(all_codes, categories=pd.Index(uniques, dtype=object))
+
+def compact_expenses(expenses_df):
+    """Compact typed copy of an expenses dataframe (expand_expenses converts back)
+
+    Missing amounts are stored as 0 paise, unparseable dates as MISSING_DAY.
+    """
+    if _is_compact(expenses_df):
+        return expenses_df
+    amounts = pd.to_numeric(expenses_df['Amount'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    days = np.full(len(expenses_df), MISSING_DAY, dtype=np.int32)
+    parsed, dated = _day_numbers(expenses_df['Date'])
+    days[dated] = parsed
+    return pd.DataFrame({
+        'Username': _string_codes(expenses_df['Username']),
+        'Category': _string_codes(expenses_df['Category']),
+        'Amount': np.rint(amounts * 100).astype(np.int64),
+        'Date': days,
+        'Note': _string_codes(expenses_df['Note']),
+    })
+
+def _union_codes(columns):
+    """Union of categorical columns, keeping object categories (pandas may infer str ones)"""
+    union = pd.api.types.union_categoricals(columns)
+    return pd.Categorical.from_codes(union.codes, categories=pd.Index(union.categories, dtype=object))
+
+def _concat_compact(frames):
+    """Concatenate compact frames, merging their category dictionaries"""
+    if not frames:
+        return compact_expenses(pd.DataFrame(columns=EXPENSE_COLUMNS))
+    if len(frames) == 1:
+        return frames[0]
+    return pd.DataFrame({
+        'Username': _union_codes([frame['Username'] for frame in frames]),
+        'Category': _union_codes([frame['Category'] for frame in frames]),
+        'Amount': np.concatenate([frame['Amount'].to_numpy() for frame in frames]),
+        'Date': np.concatenate([frame['Date'].to_numpy() for frame in frames]),
+        'Note': _union_codes([frame['Note'] for frame in frames]),
+    })
+
+def expand_expenses(expenses_df):
+    """Regular expenses dataframe (string columns, float Amount, 'YYYY-MM-DD' Date) from a compact one"""
+    if not _is_compact(expenses_df):
+        return expenses_df
+    days = expenses_df['Date'].to_numpy()
+    dates = days.astype('datetime64[D]').astype(str).astype(object)
+    dates[days == MISSING_DAY] = np.nan
+    return pd.DataFrame({
+        'Username': np.asarray(expenses_df['Username'], dtype=object),
+        'Category': np.asarray(expenses_df['Category'], dtype=object),
+        'Amount': expenses_df['Amount'].to_numpy() / 100,
+        'Date': dates,
+        'Note': np.asarray(expenses_df['Note'], dtype=object),
+    }, index=expenses_df.index)
+
+@profiled
 def get_user_expenses(expenses_df, username):
-    """Get expenses for a specific user"""
-    return expenses_df[expenses_df['Username'] == username].copy()
+    """Get expenses for a specific user (a compact frame is expanded for just their rows)
 
-def calculate_expense_metrics(user_data, user_expenses):
-    """Calculate expense metrics for dashboard"""
-    # Calculate total expenses from user expenses
+    Scans the whole frame; load_user_expenses reads one user's rows through the index instead.
+    """
+    return expand_expenses(expenses_df[(expenses_df['Username'] == username).to_numpy()].copy())
+
+
+# Shared in-memory data layer: one copy of the data per process, used by every
+# Streamlit session. Reloads only when the files change behind our back.
+USER_EXPENSE_CACHE_SIZE = 10000   # users whose expense rows are kept in memory
+PENDING_USERS_FOLD_FRACTION = 0.1  # registrations kept as dicts, as a share of the cached users, before a fold
+
+_data_lock = threading.RLock()
+_data_cache = {
+    'users': None, 'users_signature': None, 'user_index': None, 'pending_users': [],
+    'expenses': OrderedDict(), 'expense_tails': {}, 'expenses_signature': None, 'aggregates': OrderedDict(),
+    'version': 0, 'epoch': 0, 'user_versions': {}, 'population': None, 'peers': None, 'alerts': {},
+}
+
+def _file_signature(*paths):
+    """(inode, mtime, size) of each path, None for missing files"""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            # The inode changes when a file is replaced by an atomic rename
+            signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+def _users_signature():
+    if STORAGE_BACKEND == 'sqlite':
+        return _sqlite_signature()
+    return _file_signature(USERS_COLUMNAR_FILE if STORAGE_BACKEND == 'columnar' else USERS_FILE)
+
+def _expenses_signature():
+    if STORAGE_BACKEND == 'sqlite':
+        return _sqlite_signature()
+    base = EXPENSES_COLUMNAR_FILE if STORAGE_BACKEND == 'columnar' else EXPENSES_FILE
+    return _file_signature(base, EXPENSES_JOURNAL_FILE, *_journal_segments())
+
+def _bump_version(usernames=(), everyone=False):
+    """Bump the overall version and the named users' (everyone: the reload epoch in every user's version)"""
+    _data_cache['version'] += 1
+    if everyone:
+        _data_cache['epoch'] += 1
+    for username in usernames:
+        _data_cache['user_versions'][username] = _data_cache['user_versions'].get(username, 0) + 1
+
+# Position in the user deltas log the cached users reflect (guarded by
+# _user_log_lock) and the log's file signature when that was its end; rows the
+# writer read past it but that aren't applied yet, and the update batches taken
+# off the write queue but not yet persisted
+_user_log_lock = threading.Lock()
+_user_log = {'offset': None, 'signature': None, 'unapplied': [], 'inflight': [], 'folding': False}
+
+def _refresh_user_cache():
+    """Reload users (and rebuild the name index) if the file changed behind our back
+
+    Value changes other processes logged since the last read are applied in place.
+    """
+    signature = _users_signature()
+    if _data_cache['users'] is not None and _data_cache['users_signature'] == signature:
+        if STORAGE_BACKEND == 'sqlite' or _apply_logged_deltas():
+            return
+    # Holding the users lock and _user_log_lock, no batch can be written between
+    # the read and the replay below
+    with _storage_lock(USERS_LOCK_FILE, shared=True), _user_log_lock:
+        signature = _users_signature()
+        # Checked again under the locks: a fold in this process may have swapped
+        # the files in meanwhile, keeping the cached users valid
+        folded = (_data_cache['users'] is not None and _data_cache['users_signature'] == signature
+                  and STORAGE_BACKEND != 'sqlite' and _read_user_deltas(_user_log['offset']) is not None)
+        if not folded:
+            users_df = load_user_data().reset_index(drop=True)
+            if STORAGE_BACKEND != 'sqlite':
+                _user_log['offset'] = users_df.attrs['version']['deltas']
+                _user_log['signature'] = None
+                _user_log['unapplied'] = []
+            # Our own changes that aren't in storage yet are replayed on top
+            replay = [update for batch in _user_log['inflight'] for update in batch]
+    if folded:
+        _apply_logged_deltas()
+        return
+    replay += [payload for kind, payload in _write_state['queue'] if kind == 'update']
+    names = users_df['Name'].tolist()
+    _data_cache['users'] = users_df
+    # Name -> row position; reversed so duplicate names resolve to the first row
+    _data_cache['user_index'] = dict(zip(reversed(names), range(len(names) - 1, -1, -1)))
+    _data_cache['pending_users'] = []
+    _data_cache['users_signature'] = signature
+    _data_cache['population'] = None
+    _data_cache['peers'] = None
+    for username, column, delta in replay:
+        _apply_user_delta(username, column, delta)
+    _bump_version(everyone=True)
+
+def _apply_logged_deltas():
+    """Apply rows other processes appended to the deltas log; False if it was replaced (caller holds _data_lock)"""
+    signature = _file_signature(USER_DELTAS_FILE)
+    if signature == _user_log['signature'] and not _user_log['unapplied']:
+        return True
+    if not _user_log_lock.acquire(blocking=False):
+        # A batch or fold is being written: readers keep going and pick the rows up later
+        return True
+    try:
+        tail = _read_user_deltas(_user_log['offset'])
+        if tail is None:
+            return False
+        rows, _user_log['unapplied'] = _user_log['unapplied'] + tail[0], []
+        _user_log['offset'], _user_log['signature'] = tail[1], signature
+    finally:
+        _user_log_lock.release()
+    for username, column, delta in rows:
+        _apply_user_delta(username, column, delta)
+    if rows:
+        _bump_version({username for username, _, _ in rows})
+    return True
+
+def _fold_pending_users():
+    """Cached users frame with users registered since the last full read folded in (caller holds _data_lock)"""
+    pending = _data_cache['pending_users']
+    if pending:
+        _data_cache['users'] = pd.concat([_data_cache['users'], pd.DataFrame(pending)], ignore_index=True)
+        _data_cache['pending_users'] = []
+    return _data_cache['users']
+
+@profiled
+def cached_user_data():
+    """Shared users dataframe (treat as read-only; write through add_user/update_user_value)"""
+    with _data_lock:
+        _refresh_user_cache()
+        return _fold_pending_users()
+
+@profiled
+def get_user_record(username):
+    """One user's row as a Series via the name index, or None if there is no such user"""
+    with _data_lock:
+        _refresh_user_cache()
+        position = _data_cache['user_index'].get(username)
+        if position is None:
+            return None
+        users_df = _data_cache['users']
+        if position < len(users_df):
+            return users_df.iloc[position]
+        return pd.Series(_data_cache['pending_users'][position - len(users_df)])
+
+def user_count():
+    """Number of registered users"""
+    with _data_lock:
+        _refresh_user_cache()
+        return len(_data_cache['users']) + len(_data_cache['pending_users'])
+
+def _refresh_expense_cache():
+    """Drop cached expense rows and aggregates if the files changed behind our back"""
+    signature = _expenses_signature()
+    if _data_cache['expenses_signature'] != signature:
+        # Files changed outside this process (or were compacted): drop everything,
+        # after writing out queued expenses so the reload includes them
+        _flush_writes(users=False)
+        _data_cache['expenses'].clear()
+        _data_cache['expense_tails'].clear()
+        _data_cache['aggregates'].clear()
+        _data_cache['expenses_signature'] = _expenses_signature()
+        _bump_version(everyone=True)
+
+def _append_expense_rows(user_expenses, rows):
+    """Concatenate journal-style rows onto a user's cached (compact) expenses"""
+    new_rows = pd.DataFrame(rows, columns=EXPENSE_COLUMNS)
+    new_rows['Amount'] = pd.to_numeric(new_rows['Amount'])
+    new_rows['Note'] = new_rows['Note'].replace('', np.nan)
+    return _concat_compact([user_expenses, compact_expenses(new_rows)])
+
+@profiled
+def cached_user_expenses(username):
+    """Shared expense rows for one user in compact form (treat as read-only; write through add_expenses)
+
+    The cache holds compact frames so that USER_EXPENSE_CACHE_SIZE users fit in
+    memory; expand_expenses gives the regular columns.
+    """
+    with _data_lock:
+        _refresh_expense_cache()
+        cache = _data_cache['expenses']
+        if username in cache:
+            cache.move_to_end(username)
+            # Rows added since the last read are folded in once, not per add_expenses call
+            tail = _data_cache['expense_tails'].pop(username, None)
+            if tail:
+                cache[username] = _append_expense_rows(cache[username], tail)
+        else:
+            # Read-your-writes: queued rows must reach the journal before it's read
+            _flush_writes(users=False)
+            cache[username] = compact_expenses(load_user_expenses(username))
+            if len(cache) > USER_EXPENSE_CACHE_SIZE:
+                evicted, _ = cache.popitem(last=False)
+                _data_cache['expense_tails'].pop(evicted, None)
+                _data_cache['aggregates'].pop(evicted, None)
+        return cache[username]
+
+def data_version(username=None):
+    """Write-version stamp, overall or for one user; changes whenever cached data changes
+
+    A user's stamp is (reload epoch, their own counter): reloads of all the data
+    move the epoch, so users the cache hasn't seen yet get a new stamp too.
+    """
+    with _data_lock:
+        if username is None:
+            return _data_cache['version']
+        return _data_cache['epoch'], _data_cache['user_versions'].get(username, 0)
+
+@profiled
+def add_user(user_data):
+    """Add a new user through the shared data layer; False if the name is taken"""
+    # Refreshing under the users lock sees names registered by other processes too
+    with _data_lock, _storage_lock(USERS_LOCK_FILE):
+        _refresh_user_cache()
+        index = _data_cache['user_index']
+        if user_data['Name'] in index:
+            return False
+        user_data = {column: user_data.get(column) for column in USER_COLUMNS}
+        # Registration is written straight away (an O(1) append) so that the
+        # name check above stays authoritative across processes
+        if STORAGE_BACKEND == 'sqlite':
+            _sqlite_insert('users', USER_COLUMNS, [user_data])
+        elif STORAGE_BACKEND == 'columnar':
+            # Arrow files can't be appended to in place: write queued updates and
+            # apply everything logged, then rewrite with the log folded in
+            _flush_writes()
+            _refresh_user_cache()
+            _write_user_data(pd.concat([cached_user_data(), pd.DataFrame([user_data])], ignore_index=True))
+            with _user_log_lock:
+                _user_log['offset'] = _reset_user_deltas()
+                _user_log['signature'] = None
+        else:
+            _append_user_row(user_data)
+        _apply_new_user(user_data)
+        _data_cache['users_signature'] = _users_signature()
+        _bump_version([user_data['Name']])
+        return True
+
+def _apply_new_user(user_data):
+    """Add a user to the cached users, population stats and peer profiles (caller holds _data_lock)"""
+    position = len(_data_cache['users']) + len(_data_cache['pending_users'])
+    _data_cache['user_index'][user_data['Name']] = position
+    _data_cache['pending_users'].append(user_data)
+    # Folding copies the whole table, so it's done once per batch of registrations
+    if len(_data_cache['pending_users']) > PENDING_USERS_FOLD_FRACTION * len(_data_cache['users']):
+        _fold_pending_users()
+    for category in EXPENSE_CATEGORIES:
+        _population_update(category, None, pd.to_numeric(user_data.get(category), errors='coerce'))
+    _peers_set_column(position, [user_data.get(category) for category in EXPENSE_CATEGORIES], user_data['Name'])
+
+def _apply_user_delta(username, column, delta):
+    """Add delta to a cached user's column; False if there's no such user (caller holds _data_lock)"""
+    position = _data_cache['user_index'].get(username)
+    users_df = _data_cache['users']
+    if position is None or column not in users_df.columns:
+        return False
+    if position >= len(users_df):
+        # Registered since the last fold: change the pending record instead of folding
+        user_data = _data_cache['pending_users'][position - len(users_df)]
+        old_value = user_data.get(column)
+        old_value = np.nan if old_value is None else old_value
+        user_data[column] = old_value + delta
+    else:
+        column_position = users_df.columns.get_loc(column)
+        old_value = users_df.iat[position, column_position]
+        if users_df[column].dtype.kind in 'iu' and float(old_value + delta) != int(old_value + delta):
+            users_df[column] = users_df[column].astype(float)
+        users_df.iat[position, column_position] = old_value + delta
+    _population_update(column, old_value, old_value + delta)
+    if column in _PEER_COLUMNS:
+        _peers_set_value(position, column, old_value + delta)
+    return True
+
+@profiled
+def update_user_value(username, column, delta):
+    """Add delta to one user's column; the cached data changes now, the write is queued"""
+    with _data_lock:
+        _refresh_user_cache()
+        if _apply_user_delta(username, column, delta):
+            _queue_write('update', (username, column, delta))
+            _check_alerts(username, {column: delta})
+            _bump_version([username])
+
+# Background writer: update_user_value and add_expenses change the shared
+# in-memory data and return; queued changes are persisted in coalesced batches
+# (one journal append, one deltas-log append or SQLite transaction per batch)
+WRITE_QUEUE_SIZE = 1000         # queued changes before the submitter flushes them itself
+WRITE_COALESCE_DELAY = 0.005    # seconds the writer waits after a wakeup to gather a batch
+
+_write_state = {'queue': [], 'thread': None, 'wakeup': threading.Event()}
+
+def _queue_write(kind, payload):
+    """Queue a change already applied in memory (caller holds _data_lock)"""
+    _write_state['queue'].append((kind, payload))
+    if len(_write_state['queue']) >= WRITE_QUEUE_SIZE:
+        # Bounded queue: a full queue is flushed by the submitter instead
+        _flush_writes()
+        return
+    if _write_state['thread'] is None or not _write_state['thread'].is_alive():
+        _write_state['thread'] = threading.Thread(target=_write_loop, daemon=True)
+        _write_state['thread'].start()
+    _write_state['wakeup'].set()
+
+def _write_loop():
+    while True:
+        _write_state['wakeup'].wait()
+        time.sleep(WRITE_COALESCE_DELAY)
+        with _data_lock:
+            _write_state['wakeup'].clear()
+            updates = _take_writes()
+        # The users write (which may wait on a fold) runs without _data_lock
+        if updates:
+            _persist_user_updates(updates)
+
+@profiled
+def _flush_writes(users=True):
+    """Persist every queued change, grouped per table (caller holds _data_lock)
+
+    users=False leaves queued user updates for the writer (expense reads don't need them).
+    """
+    updates = _take_writes(users)
+    if updates:
+        _persist_user_updates(updates)
+
+def _take_writes(users=True):
+    """Persist queued expenses and take the queued user updates off the queue (caller holds _data_lock)
+
+    Taken updates count as in flight until _persist_user_updates has written
+    them, so a reload in between replays them instead of losing them.
+    """
+    batch = _write_state['queue']
+    _write_state['queue'] = [] if users else [(kind, payload) for kind, payload in batch if kind == 'update']
+    updates = [payload for kind, payload in batch if kind == 'update'] if users else []
+    expenses = [expense for kind, payload in batch if kind == 'expenses' for expense in payload]
+    if expenses:
+        try:
+            _persist_expenses(expenses)
+        except BaseException:
+            # Keep whatever didn't reach storage queued for the next flush
+            _write_state['queue'][:0] = [('update', update) for update in updates] + [('expenses', expenses)]
+            raise
+    if updates:
+        with _user_log_lock:
+            _user_log['inflight'].append(updates)
+    return updates
+
+def _persist_user_updates(updates):
+    """Write taken (username, column, delta) changes with one deltas-log append or transaction"""
+    deltas = {}
+    for username, column, delta in updates:
+        deltas[(username, column)] = deltas.get((username, column), 0) + delta
+    fold = False
+    try:
+        with _storage_lock(USERS_LOCK_FILE), _user_log_lock:
+            if STORAGE_BACKEND == 'sqlite':
+                with _db_lock:
+                    connection = _db()
+                    with connection:
+                        for (username, column), delta in deltas.items():
+                            connection.execute(f'UPDATE users SET {_quote(column)} = {_quote(column)} + ? WHERE Name = ?',
+                                               (_sqlite_value(delta), username))
+                        _sqlite_bump_generation(connection, 'users')
+            else:
+                if not os.path.exists(USER_DELTAS_FILE):
+                    _reset_user_deltas()
+                tail = _read_user_deltas(_user_log['offset'])
+                with open(USER_DELTAS_FILE, 'ab') as f:
+                    f.write(_encode_rows([username, column, delta] for (username, column), delta in deltas.items()))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    size = f.tell()
+                if tail is not None:
+                    # Rows other processes logged ahead of ours are applied on the next refresh;
+                    # if the log was replaced the refresh reloads instead
+                    _user_log['unapplied'].extend(tail[0])
+                    _user_log['offset'] = (tail[1][0], size)
+                    _user_log['signature'] = _file_signature(USER_DELTAS_FILE)
+                fold = size > USER_DELTAS_FOLD_BYTES and not _user_log['folding']
+                _user_log['folding'] = _user_log['folding'] or fold
+            _user_log['inflight'].remove(updates)
+    except BaseException:
+        # Back on the queue for the next flush
+        with _data_lock:
+            with _user_log_lock:
+                if updates in _user_log['inflight']:
+                    _user_log['inflight'].remove(updates)
+            _write_state['queue'][:0] = [('update', update) for update in updates]
+        raise
+    if fold:
+        threading.Thread(target=_fold_user_deltas, daemon=True).start()
+
+def _fold_user_deltas():
+    """Rewrite the users file with the deltas log applied and start a new log
+
+    The new file is built without the users lock; only swapping it in (with
+    users and deltas written meanwhile carried over) happens under the lock.
+    """
+    users_file = USERS_COLUMNAR_FILE if STORAGE_BACKEND == 'columnar' else USERS_FILE
+    # Per process: the new file is written before the users lock is taken
+    folded_file = f"{users_file}.{os.getpid()}.fold"
+    try:
+        users_df = load_user_data()
+        version = users_df.attrs['version']
+        if STORAGE_BACKEND == 'columnar':
+            _write_columnar_users(users_df, folded_file)
+        else:
+            _atomic_write_csv(users_df, folded_file)
+        with _storage_lock(USERS_LOCK_FILE), _user_log_lock:
+            appended = _appended_since('users', version)
+            tail = _read_user_deltas(version['deltas'])
+            if appended is None or tail is None:
+                # Rewritten by someone else meanwhile: nothing left to fold
+                return
+            if len(appended):
+                with open(folded_file, 'a', newline='') as f:
+                    appended.to_csv(f, header=False, index=False)
+            signature = _users_signature()
+            ours = _read_user_deltas(_user_log['offset'])
+            end = _reset_user_deltas(tail[0])
+            os.replace(folded_file, users_file)
+            if ours is not None:
+                # The cached users stay valid: rows past our position are applied on
+                # the next refresh, and the carried-over rows are all among them
+                _user_log['unapplied'].extend(ours[0])
+                _user_log['offset'], _user_log['signature'] = end, _file_signature(USER_DELTAS_FILE)
+                if _data_cache['users_signature'] == signature:
+                    _data_cache['users_signature'] = _users_signature()
+    finally:
+        _user_log['folding'] = False
+        if os.path.exists(folded_file):
+            os.remove(folded_file)
+
+def _persist_expenses(expenses):
+    """Append queued expenses to storage in one write"""
+    # The expenses lock makes the staleness check and the append one step across processes
+    with _storage_lock(EXPENSES_LOCK_FILE):
+        stale = _data_cache['expenses_signature'] != _expenses_signature()
+        append_expenses(expenses)
+        if stale:
+            # Someone else wrote too: let the next read reload instead of trusting the patched caches
+            _data_cache['expenses'].clear()
+            _data_cache['expense_tails'].clear()
+            _data_cache['aggregates'].clear()
+            _bump_version(everyone=True)
+        _data_cache['expenses_signature'] = _expenses_signature()
+
+def flush_writes():
+    """Write out queued changes now and force batched journal writes to disk"""
+    with _data_lock:
+        _flush_writes()
+    # A batch the writer thread took before us (or a fold) may still be on its way to disk
+    while _user_log['inflight'] or _user_log['folding']:
+        time.sleep(WRITE_COALESCE_DELAY)
+    flush_expense_journal()
+
+atexit.register(flush_writes)
+
+# Population statistics for the "About Student Spending" page, maintained on write
+SKETCH_RELATIVE_ACCURACY = 0.01
+_SKETCH_LOG_GAMMA = np.log((1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY))
+
+# Quantile sketch: counts in log-spaced buckets (values within 1% of the true
+# quantile), supports removals so per-user updates can be applied exactly.
+def _sketch_new():
+    return {'count': 0, 'zeros': 0, 'buckets': {}}
+
+def _sketch_add(sketch, value, weight=1):
+    """Add (or with weight=-1 remove) a value"""
+    if value is None or pd.isna(value):
+        return
+    sketch['count'] += weight
+    if value <= 0:
+        sketch['zeros'] += weight
+        return
+    bucket = int(np.ceil(np.log(value) / _SKETCH_LOG_GAMMA))
+    count = sketch['buckets'].get(bucket, 0) + weight
+    if count:
+        sketch['buckets'][bucket] = count
+    else:
+        sketch['buckets'].pop(bucket, None)
+
+def _sketch_from_values(values):
+    """Build a sketch from an array in one vectorized pass"""
+    values = values[~np.isnan(values)]
+    sketch = _sketch_new()
+    sketch['count'] = len(values)
+    positive = values[values > 0]
+    sketch['zeros'] = len(values) - len(positive)
+    buckets, counts = np.unique(np.ceil(np.log(positive) / _SKETCH_LOG_GAMMA).astype(int), return_counts=True)
+    sketch['buckets'] = dict(zip(buckets.tolist(), counts.tolist()))
+    return sketch
+
+def _bucket_value(bucket):
+    gamma = np.exp(_SKETCH_LOG_GAMMA)
+    return 2 * gamma ** bucket / (gamma + 1)
+
+def _sketch_quantile(sketch, q):
+    """Approximate q-quantile (0 <= q <= 1)"""
+    if sketch['count'] <= 0:
+        return np.nan
+    rank = q * (sketch['count'] - 1)
+    seen = sketch['zeros']
+    if rank < seen:
+        return 0.0
+    for bucket in sorted(sketch['buckets']):
+        seen += sketch['buckets'][bucket]
+        if rank < seen:
+            return _bucket_value(bucket)
+    return _bucket_value(max(sketch['buckets']))
+
+def _sketch_rank(sketch, value):
+    """Approximate percentage of values <= value"""
+    if sketch['count'] <= 0 or value is None or pd.isna(value):
+        return np.nan
+    below = sketch['zeros']
+    if value > 0:
+        limit = np.ceil(np.log(value) / _SKETCH_LOG_GAMMA)
+        below += sum(count for bucket, count in sketch['buckets'].items() if bucket <= limit)
+    return below / sketch['count'] * 100
+
+def _population():
+    """Running per-category sums, counts and sketches over the users table (caller holds _data_lock)"""
+    if _data_cache['population'] is None:
+        users_df = cached_user_data()
+        population = {}
+        for category in EXPENSE_CATEGORIES:
+            values = pd.to_numeric(users_df[category], errors='coerce').to_numpy(dtype=float)
+            sketch = _sketch_from_values(values)
+            population[category] = {'sum': float(np.nansum(values)), 'sketch': sketch}
+        _data_cache['population'] = population
+    return _data_cache['population']
+
+def _population_update(category, old_value, new_value):
+    """Replace one user's value in the population stats (None = no value)"""
+    population = _data_cache['population']
+    if population is None or category not in population:
+        return
+    stats = population[category]
+    for value, weight in ((old_value, -1), (new_value, 1)):
+        if value is not None and not pd.isna(value):
+            stats['sum'] += weight * float(value)
+            _sketch_add(stats['sketch'], float(value), weight)
+
+@profiled
+def population_statistics():
+    """Mean, median and 90th percentile per category across all users, served from running stats"""
+    with _data_lock:
+        rows = []
+        for category, stats in _population().items():
+            count = stats['sketch']['count']
+            rows.append({
+                'Category': category,
+                'Average Amount': stats['sum'] / count if count else np.nan,
+                'Median': _sketch_quantile(stats['sketch'], 0.5),
+                '90th Percentile': _sketch_quantile(stats['sketch'], 0.9),
+            })
+        return pd.DataFrame(rows)
+
+def percentile_rank(category, value):
+    """Approximate percentage of users spending at most value on category"""
+    with _data_lock:
+        return _sketch_rank(_population()[category]['sketch'], value)
+
+# Peer cohorts: every user's spending mix (category shares, scaled to unit
+# length) as one float32 matrix, so cosine similarity to all users is a single
+# vector-matrix product. Matrices are stored category-major (one contiguous
+# row per category), which keeps that product a few streaming passes; user
+# columns are updated in place on register/update.
+PEER_COHORT_SIZE = 50
+_PEER_COLUMNS = {category: number for number, category in enumerate(EXPENSE_CATEGORIES)}
+
+def _peer_profiles(spending):
+    """Unit-length columns for a categories x users spending matrix (all-zero columns stay zero)"""
+    norms = np.linalg.norm(spending, axis=0, keepdims=True)
+    return np.divide(spending, norms, out=np.zeros_like(spending), where=norms > 0)
+
+def _peers():
+    """Spending and profile matrices, columns positioned as in the user index (caller holds _data_lock)"""
+    if _data_cache['peers'] is None:
+        users_df = cached_user_data()
+        values = users_df[EXPENSE_CATEGORIES].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+        spending = np.ascontiguousarray(np.clip(np.nan_to_num(values), 0, None).T, dtype=np.float32)
+        _data_cache['peers'] = {'spending': spending, 'profiles': _peer_profiles(spending),
+                                'names': users_df['Name'].tolist(), 'count': len(users_df)}
+    return _data_cache['peers']
+
+def _peers_set_column(position, values, name=None):
+    """Write one user's spending into the peer matrices, growing them if position is new"""
+    peers = _data_cache['peers']
+    if peers is None:
+        return
+    if position >= peers['spending'].shape[1]:
+        # Grow by doubling so registrations stay amortized O(1)
+        capacity = max(2 * peers['spending'].shape[1], position + 1)
+        for matrix in ('spending', 'profiles'):
+            grown = np.zeros((len(EXPENSE_CATEGORIES), capacity), dtype=np.float32)
+            grown[:, :peers['count']] = peers[matrix][:, :peers['count']]
+            peers[matrix] = grown
+    if name is not None:
+        peers['names'].append(name)
+        peers['count'] = position + 1
+    column = np.array([pd.to_numeric(value, errors='coerce') for value in values], dtype=np.float32)
+    column = np.clip(np.nan_to_num(column), 0, None)
+    peers['spending'][:, position] = column
+    peers['profiles'][:, position] = _peer_profiles(column[:, None])[:, 0]
+
+def _peers_set_value(position, column, value):
+    """Change one category of a user's spending in the peer matrices"""
+    peers = _data_cache['peers']
+    if peers is None or position >= peers['count']:
+        return
+    values = peers['spending'][:, position].copy()
+    values[_PEER_COLUMNS[column]] = value
+    _peers_set_column(position, values)
+
+@profiled
+def peer_cohort(username, k=PEER_COHORT_SIZE):
+    """The k students whose spending mix is most like username's, and how the user compares to them
+
+    Returns (peers, benchmarks): peers has Name and Similarity (cosine of the
+    category shares, 1 = same mix) plus their spending; benchmarks has, per
+    category, the user's spending against the cohort's median and average.
+    Users without any spending are left out, and get an empty cohort themselves.
+    """
+    with _data_lock:
+        peers = _peers()
+        position = _data_cache['user_index'].get(username)
+        if position is None:
+            raise KeyError(username)
+        count = peers['count']
+        profiles = peers['profiles'][:, :count]
+        similarity = peers['profiles'][:, position] @ profiles
+        # Users with no spending have no mix to compare: they get no cohort and are in no one's
+        similarity[~profiles.any(axis=0)] = -np.inf
+        similarity[position] = -np.inf
+        k = min(k, int(np.isfinite(similarity).sum()) if profiles[:, position].any() else 0)
+        if k <= 0:
+            nearest = np.array([], dtype=np.int64)
+        else:
+            # O(n) selection of the k best, then only those are sorted
+            nearest = np.argpartition(similarity, count - k)[count - k:]
+            nearest = nearest[np.argsort(-similarity[nearest], kind='stable')]
+        spending = peers['spending'][:, nearest].T.astype(float)
+        own = peers['spending'][:, position].astype(float)
+        names = [peers['names'][column] for column in nearest]
+        scores = similarity[nearest].astype(float)
+
+    cohort = pd.DataFrame(spending, columns=EXPENSE_CATEGORIES)
+    cohort.insert(0, 'Similarity', scores)
+    cohort.insert(0, 'Name', names)
+    median = np.median(spending, axis=0) if len(spending) else np.full(len(own), np.nan)
+    average = spending.mean(axis=0) if len(spending) else np.full(len(own), np.nan)
+    difference = np.divide((own - median) * 100, median, out=np.zeros_like(own), where=median > 0)
+    benchmarks = pd.DataFrame({
+        'Category': EXPENSE_CATEGORIES,
+        'Your Spending': own,
+        'Peer Median': median,
+        'Peer Average': average,
+        'Difference %': difference,
+    })
+    return cohort, benchmarks
+
+def _append_user_row(user_data):
+    """Append one user to users.csv without rewriting it (caller holds the users lock)"""
+    exists = os.path.exists(USERS_FILE) and os.path.getsize(USERS_FILE) > 0
+    with open(USERS_FILE, 'a+b') as f:
+        if exists:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+        else:
+            f.write(_encode_rows([USER_COLUMNS]))
+        f.write(_encode_rows([_journal_row_for(user_data, USER_COLUMNS)]))
+
+@profiled
+def add_expenses(expenses):
+    """Add expenses: cached rows and aggregates update now, the journal write is queued"""
+    if not expenses:
+        return
+    expenses = [dict(expense) for expense in expenses]
+    with _data_lock:
+        _refresh_expense_cache()
+        if 'total' in _RULES_BY_INPUT:
+            # Alerts on the total need each registered user's running total
+            # before the rows are added, whether or not anything loaded it yet
+            _refresh_user_cache()
+            for username in {expense['Username'] for expense in expenses} & _data_cache['user_index'].keys():
+                user_expense_aggregates(username)
+        cache = _data_cache['expenses']
+        tails = _data_cache['expense_tails']
+        added = {}
+        for expense in expenses:
+            username = expense['Username']
+            aggregate = _data_cache['aggregates'].get(username)
+            if aggregate is not None:
+                before = aggregate['total']
+                _add_to_aggregate(aggregate, expense.get('Category'), expense.get('Amount'), expense.get('Date'))
+                added[username] = added.get(username, 0) + aggregate['total'] - before
+            if username in cache:
+                tails.setdefault(username, []).append(_journal_row(expense))
+        _queue_write('expenses', expenses)
+        for username, delta in added.items():
+            _check_alerts(username, {'total': delta})
+        _bump_version(set(expense['Username'] for expense in expenses))
+
+# Bulk expense import (bank/CSV statements)
+IMPORT_CHUNK_ROWS = 50000
+# Lower-cased statement headers accepted for each expense column
+IMPORT_COLUMN_ALIASES = {
+    'Username': ['username', 'user'],
+    'Category': ['category', 'type'],
+    'Amount': ['amount', 'debit', 'withdrawal', 'withdrawal amount', 'debit amount'],
+    'Date': ['date', 'transaction date', 'posted date', 'posting date', 'value date'],
+    'Note': ['note', 'description', 'memo', 'narration', 'details', 'payee', 'name'],
+}
+# Amount headers holding only money paid out; any other amount column is signed
+IMPORT_DEBIT_ALIASES = ('debit', 'withdrawal', 'withdrawal amount', 'debit amount')
+# Headers of a separate paid-in column: rows with a value there are credits
+IMPORT_CREDIT_ALIASES = ('credit', 'deposit', 'credit amount', 'deposit amount')
+# Date formats a statement may use; one is picked per statement. ISO dates are
+# tried first, then the day-first formats (or the month-first ones if asked for)
+IMPORT_ISO_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%Y-%m-%d %H:%M:%S')
+IMPORT_DAY_FIRST_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%d/%m/%y', '%d-%m-%y',
+                            '%d %b %Y', '%d-%b-%Y', '%d-%b-%y')
+IMPORT_MONTH_FIRST_FORMATS = ('%m/%d/%Y', '%m-%d-%Y', '%m.%d.%Y', '%m/%d/%y', '%m-%d-%y',
+                              '%b %d %Y', '%b %d, %Y')
+IMPORT_DATE_SAMPLE_ROWS = 1000   # dates looked at to pick a statement's format
+OFX_DATE_FORMAT = '%Y%m%d'
+_OFX_FIELD = re.compile(r'<(TRNAMT|DTPOSTED|NAME|MEMO)>([^<\r\n]*)', re.IGNORECASE)
+
+def _category_key(category):
+    return re.sub(r'[^a-z0-9]', '', str(category).lower())
+
+_CATEGORY_LOOKUP = {_category_key(category): category for category in EXPENSE_CATEGORIES}
+
+def _parse_amounts(values):
+    """Statement amounts as floats, ignoring currency symbols and separators"""
+    return pd.to_numeric(values.astype(str).str.replace(r'[^0-9.\-]', '', regex=True), errors='coerce').astype(float)
+
+def _read_csv_statement(source, chunk_rows, debits_negative=False):
+    """Yield chunks of a CSV statement with columns renamed to EXPENSE_COLUMNS
+
+    Amounts come out positive for money spent and negative for credits.
+    """
+    with pd.read_csv(source, chunksize=chunk_rows, dtype=str) as chunks:
+        for chunk in chunks:
+            headers = {column.strip().lower(): column for column in chunk.columns}
+            renamed = pd.DataFrame(index=chunk.index)
+            for column, aliases in IMPORT_COLUMN_ALIASES.items():
+                match = next((alias for alias in aliases if alias in headers), None)
+                renamed[column] = chunk[headers[match]] if match is not None else None
+                if column == 'Amount':
+                    amounts = _parse_amounts(renamed[column])
+                    if debits_negative and match not in IMPORT_DEBIT_ALIASES:
+                        amounts = -amounts
+            credit = next((headers[alias] for alias in IMPORT_CREDIT_ALIASES if alias in headers), None)
+            if credit is not None:
+                credits = _parse_amounts(chunk[credit])
+                credited = amounts.isna() & (credits > 0)
+                amounts[credited] = -credits[credited]
+            renamed['Amount'] = amounts
+            yield renamed
+
+def _read_ofx_statement(source, chunk_rows):
+    """Yield chunks of transactions from an OFX/QFX statement, streaming line by line
+
+    OFX amounts are negative for debits; they come out positive, credits negative.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            yield from _read_ofx_statement(f, chunk_rows)
+        return
+    wrapped = not isinstance(source, io.TextIOBase)
+    lines = io.TextIOWrapper(source, encoding='utf-8', errors='replace') if wrapped else source
+    try:
+        records, current = [], None
+        for line in lines:
+            upper = line.upper()
+            if '<STMTTRN>' in upper:
+                current = {}
+            if current is not None:
+                for field, value in _OFX_FIELD.findall(line):
+                    current[field.upper()] = value.strip()
+            if '</STMTTRN>' in upper and current is not None:
+                records.append({
+                    'Username': None, 'Category': None,
+                    'Amount': -pd.to_numeric(current.get('TRNAMT'), errors='coerce'),
+                    'Date': current.get('DTPOSTED', '')[:8],
+                    'Note': current.get('NAME') or current.get('MEMO'),
+                })
+                current = None
+                if len(records) >= chunk_rows:
+                    yield pd.DataFrame(records, columns=EXPENSE_COLUMNS)
+                    records = []
+        if records:
+            yield pd.DataFrame(records, columns=EXPENSE_COLUMNS)
+    finally:
+        if wrapped:
+            # Hand the caller's file object back open
+            lines.detach()
+
+def _statement_date_format(dates, dayfirst=True):
+    """The date format matching most of a statement's first dates, None if none does
+
+    Ambiguous dates like 01/05/2025 are read day first unless dayfirst is False.
+    """
+    sample = dates.dropna().astype(str).str.strip()
+    sample = sample[sample != ''].iloc[:IMPORT_DATE_SAMPLE_ROWS]
+    best, best_count = None, 0
+    candidates = IMPORT_ISO_DATE_FORMATS + (IMPORT_DAY_FIRST_FORMATS if dayfirst else IMPORT_MONTH_FIRST_FORMATS)
+    for date_format in candidates:
+        count = int(pd.to_datetime(sample, format=date_format, errors='coerce').notna().sum())
+        if count > best_count:
+            best, best_count = date_format, count
+    return best
+
+def _normalize_import_chunk(chunk, username, date_format):
+    """Validate and normalize a statement chunk; returns (valid rows, invalid row count, credit row count)
+
+    Dates not in date_format count as invalid.
+    """
+    if username is not None:
+        chunk['Username'] = username
+    amounts = pd.to_numeric(chunk['Amount'], errors='coerce').astype(float)
+    if date_format is None:
+        dates = pd.Series(pd.NaT, index=chunk.index, dtype='datetime64[ns]')
+    else:
+        dates = pd.to_datetime(chunk['Date'].astype(str).str.strip(), format=date_format, errors='coerce')
+    categories = chunk['Category'].map(lambda category: _CATEGORY_LOOKUP.get(_category_key(category), category), na_action='ignore')
+    normalized = pd.DataFrame({
+        'Username': chunk['Username'],
+        'Category': categories.fillna('Other'),
+        'Amount': amounts.round(2),
+        'Date': dates.dt.strftime('%Y-%m-%d'),
+        'Note': chunk['Note'],
+    })
+    # Money paid in (salary, refunds) isn't an expense
+    credits = (normalized['Amount'] < 0).to_numpy()
+    valid = (normalized['Username'].notna() & (normalized['Amount'] > 0) & normalized['Date'].notna()).to_numpy()
+    return normalized[valid], int((~valid & ~credits).sum()), int(credits.sum())
+
+def _expense_hashes(expenses_df):
+    """64-bit hash per expense row over the fields that identify a statement line"""
+    keys = pd.DataFrame({
+        'Username': expenses_df['Username'].astype(str),
+        'Category': expenses_df['Category'].astype(str),
+        'Amount': pd.to_numeric(expenses_df['Amount'], errors='coerce').astype(float).round(2),
+        'Date': pd.to_datetime(expenses_df['Date'], errors='coerce').dt.strftime('%Y-%m-%d'),
+        'Note': expenses_df['Note'].fillna('').astype(str),
+    })
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+@profiled
+def import_expenses(source, username=None, file_format=None, chunk_rows=IMPORT_CHUNK_ROWS, debits_negative=False,
+                    date_format=None, dayfirst=True):
+    """Stream a CSV or OFX statement into the expenses store in one batched write.
+
+    source is a path or file object. username overrides any Username column;
+    rows for users that aren't registered are skipped. CSV amounts are money
+    spent and negative amounts are credits, unless debits_negative says the
+    statement signs it the other way round (OFX always does); credits are skipped.
+    CSV dates are read with date_format (a strptime format) if given, otherwise
+    with one format picked from the statement's first dates: ISO if they are,
+    else day first (month first with dayfirst=False). Rows whose date doesn't
+    match that format are counted as invalid.
+    Identical rows (same user, category, amount, date and note) are matched up
+    by occurrence: the n-th one in the statement is skipped if n are already stored.
+    Returns counts of imported, duplicate, credit, unknown-user and invalid rows.
+    """
+    if file_format is None:
+        name = source if isinstance(source, str) else getattr(source, 'name', '')
+        file_format = 'ofx' if str(name).lower().endswith(('.ofx', '.qfx')) else 'csv'
+    if file_format == 'ofx':
+        reader = _read_ofx_statement
+        date_format = OFX_DATE_FORMAT
+    else:
+        reader = functools.partial(_read_csv_statement, debits_negative=debits_negative)
+
+    stored = Counter()
+    occurrences = Counter()
+    registered = {}
+    batches = []
+    summary = {'imported': 0, 'duplicates': 0, 'credits': 0, 'unknown_users': 0, 'invalid': 0}
+    for chunk in reader(source, chunk_rows):
+        if date_format is None:
+            date_format = _statement_date_format(chunk['Date'], dayfirst)
+        rows, invalid, credits = _normalize_import_chunk(chunk, username, date_format)
+        summary['invalid'] += invalid
+        summary['credits'] += credits
+        # Hash counts of existing rows, loaded per user the first time they appear
+        for user in set(rows['Username']) - set(registered):
+            registered[user] = get_user_record(user) is not None
+            if registered[user]:
+                existing = cached_user_expenses(user)
+                if not existing.empty:
+                    stored.update(_expense_hashes(expand_expenses(existing)).tolist())
+        known = rows['Username'].map(registered).to_numpy(dtype=bool)
+        summary['unknown_users'] += int((~known).sum())
+        rows = rows[known]
+        hashes = _expense_hashes(rows)
+        keep = np.zeros(len(rows), dtype=bool)
+        for i, row_hash in enumerate(hashes.tolist()):
+            occurrences[row_hash] += 1
+            keep[i] = occurrences[row_hash] > stored[row_hash]
+        summary['duplicates'] += int((~keep).sum())
+        batches.append(rows[keep])
+
+    new_rows = pd.concat(batches, ignore_index=True) if batches else pd.DataFrame(columns=EXPENSE_COLUMNS)
+    new_rows['Note'] = new_rows['Note'].astype(object).where(new_rows['Note'].notna(), None)
+    add_expenses(new_rows.to_dict('records'))
+    summary['imported'] = len(new_rows)
+    return summary
+
+# Running per-user totals, kept up to date by add_expenses
+def _month_key(date):
+    """'YYYY-MM' for a date string or timestamp, None if missing"""
+    if isinstance(date, str):
+        return date[:7] if len(date) >= 7 else None
+    if date is None or pd.isna(date):
+        return None
+    return pd.Timestamp(date).strftime('%Y-%m')
+
+# Time-bucketed rollups: per user, a dense (period x category) array of totals
+# for months and for Monday-based weeks, grown as new periods/categories appear
+ROLLUP_PERIODS = ('month', 'week')
+
+def _day_number(date):
+    """Days since 1970-01-01 for a date string or timestamp, None if missing/unparseable"""
+    if date is None or isinstance(date, str) and not date:
+        return None
+    if isinstance(date, str):
+        try:
+            # ISO dates (and 'YYYY-MM' labels) without going through pandas
+            return int(np.datetime64(date[:10], 'D').astype(np.int64))
+        except ValueError:
+            pass
+    date = pd.to_datetime(date, errors='coerce')
+    if pd.isna(date):
+        return None
+    return int(np.datetime64(date, 'D').astype(np.int64))
+
+def _day_numbers(dates):
+    """Day numbers for a column of dates, plus a mask of the parseable ones"""
+    dates = pd.to_datetime(dates, errors='coerce')
+    valid = dates.notna().to_numpy()
+    return dates.to_numpy()[valid].astype('datetime64[D]').astype(np.int64), valid
+
+def _period_numbers(days, period):
+    """Month numbers (months since 1970-01) or week numbers for day numbers"""
+    days = np.asarray(days, dtype=np.int64)
+    if period == 'month':
+        return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    # 1970-01-01 was a Thursday: shift so weeks start on Monday
+    return (days + 3) // 7
+
+def period_label(number, period):
+    """'YYYY-MM' for a month number, the Monday's 'YYYY-MM-DD' for a week number"""
+    if period == 'month':
+        return str(np.datetime64(int(number), 'M'))
+    return str(np.datetime64(int(number) * 7 - 3, 'D'))
+
+def _rollup_new():
+    return {'columns': {}, **{period: {'start': 0, 'totals': np.zeros((0, 0))} for period in ROLLUP_PERIODS}}
+
+def _rollup_column(rollup, category):
+    """Column of a category in the rollup arrays, adding one if it's new"""
+    column = rollup['columns'].get(category)
+    if column is None:
+        column = rollup['columns'][category] = len(rollup['columns'])
+        for period in ROLLUP_PERIODS:
+            totals = rollup[period]['totals']
+            rollup[period]['totals'] = np.pad(totals, ((0, 0), (0, 1)))
+    return column
+
+def _rollup_span(buckets, first, last):
+    """Grow a period array so periods first..last have rows"""
+    totals = buckets['totals']
+    if not len(totals):
+        buckets['start'] = first
+        buckets['totals'] = np.zeros((last - first + 1, totals.shape[1]))
+        return
+    before = max(0, buckets['start'] - first)
+    after = max(0, last + 1 - (buckets['start'] + len(totals)))
+    if before or after:
+        buckets['totals'] = np.pad(totals, ((before, after), (0, 0)))
+        buckets['start'] -= before
+
+def _rollup_add(rollup, categories, days, amounts):
+    """Fold arrays of categories, day numbers and amounts into a rollup in one vectorized pass"""
+    if not len(days):
+        return
+    names, inverse = np.unique(np.asarray(categories, dtype=object).astype(str), return_inverse=True)
+    columns = np.array([_rollup_column(rollup, name) for name in names])[inverse]
+    for period in ROLLUP_PERIODS:
+        numbers = _period_numbers(days, period)
+        buckets = rollup[period]
+        _rollup_span(buckets, int(numbers.min()), int(numbers.max()))
+        np.add.at(buckets['totals'], (numbers - buckets['start'], columns), amounts)
+
+def _rollup_add_one(rollup, category, amount, day):
+    """Fold one expense into a rollup (amortized O(1): arrays only grow for new periods/categories)"""
+    column = _rollup_column(rollup, category)
+    for period in ROLLUP_PERIODS:
+        number = int(_period_numbers(day, period))
+        buckets = rollup[period]
+        _rollup_span(buckets, number, number)
+        buckets['totals'][number - buckets['start'], column] += amount
+
+def _add_to_aggregate(aggregate, category, amount, date):
+    """Fold one expense into a running aggregate in O(1)"""
+    amount = float(amount) if amount not in (None, '') and not pd.isna(amount) else 0.0
+    aggregate['total'] += amount
+    aggregate['count'] += 1
+    has_category = category not in (None, '') and not pd.isna(category)
+    if has_category:
+        aggregate['by_category'][category] = aggregate['by_category'].get(category, 0.0) + amount
+    month = _month_key(date)
+    if month is not None:
+        aggregate['by_month'][month] = aggregate['by_month'].get(month, 0.0) + amount
+    day = _day_number(date)
+    if has_category and day is not None:
+        _rollup_add_one(aggregate['rollup'], str(category), amount, day)
+
+def _build_aggregate(user_expenses):
+    """Compute a user's running aggregate from scratch"""
+    aggregate = {'total': 0.0, 'count': len(user_expenses), 'by_category': {}, 'by_month': {},
+                 'rollup': _rollup_new()}
     if user_expenses.empty:
+        return aggregate
+    amounts = pd.to_numeric(user_expenses['Amount'], errors='coerce')
+    aggregate['total'] = float(amounts.sum())
+    aggregate['by_category'] = amounts.groupby(user_expenses['Category'], observed=True).sum().to_dict()
+    months = pd.to_datetime(user_expenses['Date'], errors='coerce').dt.strftime('%Y-%m')
+    aggregate['by_month'] = amounts.groupby(months).sum().to_dict()
+    days, dated = _day_numbers(user_expenses['Date'])
+    categories = user_expenses['Category'].to_numpy(dtype=object)[dated]
+    keep = pd.notna(categories) & (categories != '')
+    _rollup_add(aggregate['rollup'], categories[keep], days[keep], amounts.fillna(0).to_numpy()[dated][keep])
+    return aggregate
+
+def user_expense_aggregates(username):
+    """Per-user totals: {'total', 'count', 'by_category', 'by_month', 'rollup'}; built once, then updated on insert"""
+    with _data_lock:
+        _refresh_expense_cache()
+        aggregates = _data_cache['aggregates']
+        aggregate = aggregates.get(username)
+        if aggregate is None:
+            if STORAGE_BACKEND == 'sqlite':
+                # Pushed down to GROUP BY queries instead of loading the rows
+                _flush_writes(users=False)
+                aggregate = _sqlite_aggregate(username)
+            else:
+                aggregate = _build_aggregate(expand_expenses(cached_user_expenses(username)))
+            aggregates[username] = aggregate
+            # Evicted with the user's cached rows, and capped the same way for
+            # SQLite, where aggregates are built without loading the rows
+            if len(aggregates) > USER_EXPENSE_CACHE_SIZE:
+                aggregates.popitem(last=False)
+        else:
+            aggregates.move_to_end(username)
+        return aggregate
+
+def _period_number(value, period):
+    """Period number for a date or a period label"""
+    day = _day_number(value)
+    return None if day is None else int(_period_numbers(day, period))
+
+@profiled
+def expense_rollup(username, period='month', start=None, end=None):
+    """A user's totals per period x category between start and end (dates or period labels, inclusive)
+
+    Answered from the running rollup arrays, zero-filled so every period in the
+    range has a row; expenses without a date or category aren't bucketed.
+    """
+    if period not in ROLLUP_PERIODS:
+        raise ValueError(f"period must be one of {ROLLUP_PERIODS}")
+    with _data_lock:
+        rollup = user_expense_aggregates(username)['rollup']
+        buckets = rollup[period]
+        first, last = buckets['start'], buckets['start'] + len(buckets['totals']) - 1
+        start = _period_number(start, period) if start is not None else None
+        end = _period_number(end, period) if end is not None else None
+        if start is not None:
+            first = max(first, start)
+        if end is not None:
+            last = min(last, end)
+        totals = buckets['totals'][max(first - buckets['start'], 0):max(last - buckets['start'] + 1, 0)].copy()
+        categories = list(rollup['columns'])
+    rollup_df = pd.DataFrame(totals, columns=categories,
+                             index=pd.Index([period_label(number, period) for number in range(first, first + len(totals))],
+                                            name='Period'))
+    return rollup_df[sorted(categories)]
+
+@profiled
+def expense_totals_between(username, start=None, end=None, period='month'):
+    """Per-category totals over a range of periods, shaped like calculate_expense_metrics' breakdown"""
+    totals = expense_rollup(username, period, start, end).sum()
+    totals = totals[totals != 0]
+    return pd.DataFrame({'Category': totals.index, 'Amount': totals.to_numpy()})
+
+# Expense history pages: the filtered, sorted row order of a user's expenses
+# (row positions, or row ids on SQLite) is worked out once per data change and
+# filter/sort choice, then each page fetches only its own rows
+HISTORY_PAGE_SIZE = 50
+HISTORY_SORT_COLUMNS = ('Date', 'Amount', 'Category')
+HISTORY_CACHE_SIZE = 32     # (user, filters, sort) orderings kept
+
+_history_cache = OrderedDict()
+
+def _history_order(expenses_df, sort_by, descending, categories, start, end, min_amount, max_amount):
+    """Positions of the matching rows of expenses_df (regular or compact) in display order"""
+    keep = np.ones(len(expenses_df), dtype=bool)
+    if categories:
+        keep &= expenses_df['Category'].isin(categories).to_numpy()
+    if _is_compact(expenses_df):
+        days = expenses_df['Date'].to_numpy().astype(float)
+        days[expenses_df['Date'].to_numpy() == MISSING_DAY] = np.nan
+        amounts = expenses_df['Amount'].to_numpy() / 100
+    else:
+        days = np.full(len(expenses_df), np.nan)
+        parsed, dated = _day_numbers(expenses_df['Date'])
+        days[dated] = parsed
+        amounts = pd.to_numeric(expenses_df['Amount'], errors='coerce').to_numpy(dtype=float)
+    # Undated rows never match a date bound (NaN comparisons are False)
+    if start is not None:
+        keep &= days >= start
+    if end is not None:
+        keep &= days <= end
+    if min_amount is not None:
+        keep &= amounts >= min_amount
+    if max_amount is not None:
+        keep &= amounts <= max_amount
+    positions = np.flatnonzero(keep)
+    if descending:
+        # Reversed first so that rows with equal keys show newest first
+        positions = positions[::-1]
+    keys = {'Date': days, 'Amount': amounts, 'Category': expenses_df['Category'].to_numpy(dtype=object)}[sort_by]
+    order = pd.Series(keys[positions]).sort_values(ascending=not descending, kind='stable', na_position='last')
+    return positions[order.index.to_numpy()]
+
+def _sqlite_history_ids(username, sort_by, descending, categories, start, end, min_amount, max_amount):
+    """Row ids of the matching expenses in display order"""
+    where, params = ['Username = ?'], [username]
+    if categories:
+        where.append(f"Category IN ({', '.join('?' * len(categories))})")
+        params.extend(categories)
+    for column, operator, value in (('Date', '>=', start), ('Date', '<=', end),
+                                    ('Amount', '>=', min_amount), ('Amount', '<=', max_amount)):
+        if value is not None:
+            where.append(f'{column} {operator} ?')
+            params.append(str(np.datetime64(value, 'D')) if column == 'Date' else value)
+    direction = 'DESC' if descending else 'ASC'
+    rows = _db_reader().execute(
+        f"SELECT id FROM expenses WHERE {' AND '.join(where)} "
+        f'ORDER BY {sort_by} IS NULL, {sort_by} {direction}, id {direction}', params
+    ).fetchall()
+    return np.array([row[0] for row in rows], dtype=np.int64)
+
+def _sqlite_rows_by_id(ids):
+    """Expenses with the given ids, in that order"""
+    page_df = _sqlite_query(f"SELECT id, Username, Category, Amount, Date, Note FROM expenses "
+                            f"WHERE id IN ({', '.join('?' * len(ids))})", [int(i) for i in ids])
+    return page_df.set_index('id').reindex(ids).reset_index(drop=True)
+
+@profiled
+def expense_history_page(username, page=0, page_size=HISTORY_PAGE_SIZE, sort_by='Date', descending=True,
+                         categories=None, start=None, end=None, min_amount=None, max_amount=None):
+    """One page of a user's expenses, filtered and sorted server-side
+
+    categories limits the rows to those categories, start/end to dates between
+    them (inclusive) and min_amount/max_amount to amounts in that range.
+    Returns (page dataframe, number of matching rows).
+    """
+    if sort_by not in HISTORY_SORT_COLUMNS:
+        raise ValueError(f"sort_by must be one of {HISTORY_SORT_COLUMNS}")
+    categories = tuple(sorted(categories)) if categories else None
+    start = _day_number(start) if start is not None else None
+    end = _day_number(end) if end is not None else None
+    page = max(int(page), 0)
+    key = (username, sort_by, descending, categories, start, end, min_amount, max_amount)
+    with _data_lock:
+        _refresh_expense_cache()
+        # Entries are (what the order was computed from, row order)
+        cached = _history_cache.get(key)
+        if STORAGE_BACKEND == 'sqlite':
+            # Read-your-writes: queued rows must be in the table before it's queried
+            _flush_writes(users=False)
+            # PRAGMA data_version only moves on other connections' commits; ours bump the user's version
+            source = (_sqlite_signature(), data_version(username))
+            if cached is None or cached[0] != source:
+                cached = (source, _sqlite_history_ids(username, sort_by, descending, categories,
+                                                      start, end, min_amount, max_amount))
+            page_df = _sqlite_rows_by_id(cached[1][page * page_size:(page + 1) * page_size])
+        else:
+            # The user's cached frame is replaced whenever their rows change
+            expenses_df = cached_user_expenses(username)
+            if cached is None or cached[0] is not expenses_df:
+                cached = (expenses_df, _history_order(expenses_df, sort_by, descending, categories,
+                                                      start, end, min_amount, max_amount))
+            # Only the rows shown are expanded
+            page_df = expand_expenses(expenses_df.take(cached[1][page * page_size:(page + 1) * page_size]))
+        count = len(cached[1])
+        _history_cache[key] = cached
+        _history_cache.move_to_end(key)
+        if len(_history_cache) > HISTORY_CACHE_SIZE:
+            _history_cache.popitem(last=False)
+    return page_df.reset_index(drop=True), count
+
+def rebuild_user_aggregates(username=None):
+    """Throw away running aggregates (one user or all) so the next lookup recomputes them"""
+    with _data_lock:
+        if username is None:
+            _data_cache['aggregates'].clear()
+        else:
+            _data_cache['aggregates'].pop(username, None)
+        _bump_version([username] if username is not None else (), everyone=username is None)
+
+@profiled
+def calculate_expense_metrics(user_data, user_expenses=None):
+    """Calculate expense metrics for dashboard (from the running aggregates if no expenses are given)"""
+    if user_expenses is not None:
+        user_expenses = expand_expenses(user_expenses)
+    if user_expenses is None:
+        aggregate = user_expense_aggregates(user_data['Name'])
+        total_expenses = aggregate['total']
+        expense_by_category = pd.DataFrame(sorted(aggregate['by_category'].items()), columns=['Category', 'Amount'])
+    # Calculate total expenses from user expenses
+    elif user_expenses.empty:
         total_expenses = 0
         expense_by_category = pd.DataFrame(columns=['Category', 'Amount'])
     else:
         total_expenses = user_expenses['Amount'].sum()
-        expense_by_category = user_expenses.groupby('Category')['Amount'].sum().reset_index()
+        expense_by_category = user_expenses.groupby('Category', observed=True)['Amount'].sum().reset_index()
    
     # Get income
     income = user_data['Monthly_Income']
@@ -69,8 +2421,106 @@ def calculate_expense_metrics(user_data, user_expenses):
    
     return total_expenses, expense_by_category, income, savings, expense_ratio
 
+# Budget optimization tips: rule -> (section, message), in the order they are generated
+OPTIMIZATION_TIPS = {
+    'housing_ratio': ('Housing', "Your housing costs exceed 40% of your income. Consider finding roommates or cheaper accommodation."),
+    'food_ratio': ('Food', "Your food expenses are higher than recommended. Try meal planning to reduce costs."),
+    'dining_ratio': ('Food', "You're spending more on takeaways/dining than groceries. Cook at home more often to save money."),
+    'transport_ratio': ('Transportation', "Your transportation costs are high. Look into student discount passes or carpooling."),
+    'entertainment_ratio': ('Entertainment', "Your entertainment spending is high. Look for free campus events and student discounts."),
+    'savings_rate': ('Savings', "You're saving less than 10% of your income. Try to increase this to build an emergency fund."),
+}
+# Limit each rule compares its ratio against (savings_rate applies below it, the others above)
+TIP_THRESHOLDS = {
+    'housing_ratio': 0.4,
+    'food_ratio': 0.15,
+    'dining_ratio': 0.5,
+    'transport_ratio': 0.1,
+    'entertainment_ratio': 0.1,
+    'savings_rate': 0.1,
+}
+
+# Budget alerts: the tip rules re-checked on every insert. Each rule lists the
+# values it reads (user columns, or 'total' for all the user's expenses); an
+# insert re-checks only the rules reading a changed value, before vs after the
+# delta, and records an alert when a rule starts to apply.
+ALERT_HISTORY = 20     # alerts kept per user until they're shown
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator > 0 else 0
+
+ALERT_RULES = {
+    'housing_ratio': (('Student_Accommodation', 'Monthly_Income'),
+                      lambda v: v['Student_Accommodation'] > 0
+                      and _ratio(v['Student_Accommodation'], v['Monthly_Income']) > TIP_THRESHOLDS['housing_ratio']),
+    'food_ratio': (('Grocery_shopping', 'Takeaways/dining', 'Monthly_Income'),
+                   lambda v: v['Grocery_shopping'] + v['Takeaways/dining'] > 0
+                   and _ratio(v['Grocery_shopping'] + v['Takeaways/dining'], v['Monthly_Income'])
+                   > TIP_THRESHOLDS['food_ratio']),
+    'dining_ratio': (('Grocery_shopping', 'Takeaways/dining'),
+                     lambda v: _ratio(v['Takeaways/dining'], v['Grocery_shopping'] + v['Takeaways/dining'])
+                     > TIP_THRESHOLDS['dining_ratio']),
+    'transport_ratio': (('Public_Transportation', 'Monthly_Income'),
+                        lambda v: v['Public_Transportation'] > 0
+                        and _ratio(v['Public_Transportation'], v['Monthly_Income']) > TIP_THRESHOLDS['transport_ratio']),
+    'entertainment_ratio': (('Entertainment', 'Monthly_Income'),
+                            lambda v: v['Entertainment'] > 0
+                            and _ratio(v['Entertainment'], v['Monthly_Income']) > TIP_THRESHOLDS['entertainment_ratio']),
+    'savings_rate': (('total', 'Monthly_Income'),
+                     lambda v: v['Monthly_Income'] > 0
+                     and _ratio(v['Monthly_Income'] - v['total'], v['Monthly_Income']) < TIP_THRESHOLDS['savings_rate']),
+}
+
+# Value -> rules reading it
+_RULES_BY_INPUT = {name: [rule for rule, (inputs, _) in ALERT_RULES.items() if name in inputs]
+                   for inputs, _ in ALERT_RULES.values() for name in inputs}
+
+def _alert_value(username, name):
+    """Current value of a rule input for a user, from the cached users and running totals"""
+    if name == 'total':
+        aggregate = _data_cache['aggregates'].get(username)
+        return aggregate['total'] if aggregate is not None else None
+    users_df = _data_cache['users']
+    position = _data_cache['user_index'].get(username)
+    if position is None:
+        return None
+    if position >= len(users_df):
+        value = _data_cache['pending_users'][position - len(users_df)].get(name)
+    else:
+        value = users_df.iat[position, users_df.columns.get_loc(name)]
+    value = pd.to_numeric(value, errors='coerce')
+    return 0.0 if pd.isna(value) else float(value)
+
+def _check_alerts(username, deltas):
+    """Record alerts for rules a change of {input: delta} made start to apply (caller holds _data_lock)"""
+    rules = {rule for name in deltas for rule in _RULES_BY_INPUT.get(name, ())}
+    if rules:
+        # add_expenses can run before anything loaded the users
+        _refresh_user_cache()
+    for rule in rules:
+        inputs, test = ALERT_RULES[rule]
+        after = {name: _alert_value(username, name) for name in inputs}
+        if any(value is None for value in after.values()):
+            continue
+        before = {name: value - deltas.get(name, 0) for name, value in after.items()}
+        if test(after) and not test(before):
+            section, message = OPTIMIZATION_TIPS[rule]
+            alerts = _data_cache['alerts'].setdefault(username, [])
+            alerts.append({'rule': rule, 'section': section, 'message': message,
+                           'time': time.strftime('%Y-%m-%d %H:%M:%S')})
+            del alerts[:-ALERT_HISTORY]
+
+def pending_alerts(username, clear=True):
+    """Alerts recorded for a user since they were last shown, oldest first"""
+    with _data_lock:
+        if clear:
+            return _data_cache['alerts'].pop(username, [])
+        return list(_data_cache['alerts'].get(username, []))
+
+@profiled
 def generate_optimization_tips(user_data, user_expenses):
     """Generate budget optimization tips based on user data and expenses"""
+    user_expenses = expand_expenses(user_expenses)
     tips = {}
    
     # Calculate total expenses
@@ -83,8 +2533,8 @@ def generate_optimization_tips(user_data, user_expenses):
         housing_ratio = accommodation_cost / income if income > 0 else 0
         tips['Housing'] = []
        
-        if housing_ratio > 0.4:
-            tips['Housing'].append("Your housing costs exceed 40% of your income. Consider finding roommates or cheaper accommodation.")
+        if housing_ratio > TIP_THRESHOLDS['housing_ratio']:
+            tips['Housing'].append(OPTIMIZATION_TIPS['housing_ratio'][1])
    
    
     # Food tips
@@ -98,11 +2548,11 @@ def generate_optimization_tips(user_data, user_expenses):
        
         tips['Food'] = []
        
-        if food_ratio > 0.15:
-            tips['Food'].append("Your food expenses are higher than recommended. Try meal planning to reduce costs.")
+        if food_ratio > TIP_THRESHOLDS['food_ratio']:
+            tips['Food'].append(OPTIMIZATION_TIPS['food_ratio'][1])
        
-        if dining_ratio > 0.5:
-            tips['Food'].append("You're spending more on takeaways/dining than groceries. Cook at home more often to save money.")
+        if dining_ratio > TIP_THRESHOLDS['dining_ratio']:
+            tips['Food'].append(OPTIMIZATION_TIPS['dining_ratio'][1])
        
        
        
@@ -114,8 +2564,8 @@ def generate_optimization_tips(user_data, user_expenses):
        
         tips['Transportation'] = []
        
-        if transport_ratio > 0.1:
-            tips['Transportation'].append("Your transportation costs are high. Look into student discount passes or carpooling.")
+        if transport_ratio > TIP_THRESHOLDS['transport_ratio']:
+            tips['Transportation'].append(OPTIMIZATION_TIPS['transport_ratio'][1])
    
    
     # Entertainment tips
@@ -125,8 +2575,8 @@ def generate_optimization_tips(user_data, user_expenses):
        
         tips['Entertainment'] = []
        
-        if entertainment_ratio > 0.1:
-            tips['Entertainment'].append("Your entertainment spending is high. Look for free campus events and student discounts.")
+        if entertainment_ratio > TIP_THRESHOLDS['entertainment_ratio']:
+            tips['Entertainment'].append(OPTIMIZATION_TIPS['entertainment_ratio'][1])
        
    
     # General savings tips
@@ -135,9 +2585,173 @@ def generate_optimization_tips(user_data, user_expenses):
        
         tips['Savings'] = []
        
-        if savings_rate < 0.1:
-            tips['Savings'].append("You're saving less than 10% of your income. Try to increase this to build an emergency fund.")
+        if savings_rate < TIP_THRESHOLDS['savings_rate']:
+            tips['Savings'].append(OPTIMIZATION_TIPS['savings_rate'][1])
        
    
    
     return tips
+
+def generate_optimization_tips_batch(users_df, expense_totals=None):
+    """Evaluate the optimization tip rules for every user at once.
+
+    expense_totals maps username -> total expenses (missing users count as 0).
+    Returns a boolean matrix indexed like users_df: one column per section
+    (present in that user's tips dict) and one per rule in OPTIMIZATION_TIPS.
+    """
+    def column(name):
+        return pd.to_numeric(users_df[name], errors='coerce').to_numpy(dtype=float)
+
+    def ratio(numerator, denominator):
+        # numerator / denominator where denominator > 0, else 0 (as in the per-user rules)
+        out = np.zeros(len(numerator))
+        np.divide(numerator, denominator, out=out, where=denominator > 0)
+        return out
+
+    income = column('Monthly_Income')
+    if expense_totals is None:
+        total_expenses = np.zeros(len(users_df))
+    else:
+        total_expenses = users_df['Name'].map(expense_totals).fillna(0).to_numpy(dtype=float)
+
+    accommodation = column('Student_Accommodation')
+    grocery = column('Grocery_shopping')
+    dining = column('Takeaways/dining')
+    food = grocery + dining
+    transport = column('Public_Transportation')
+    entertainment = column('Entertainment')
+
+    matrix = pd.DataFrame({
+        'Name': users_df['Name'].to_numpy(),
+        'Housing': accommodation > 0,
+        'Food': food > 0,
+        'Transportation': transport > 0,
+        'Entertainment': entertainment > 0,
+        'Savings': income > 0,
+    }, index=users_df.index)
+    matrix['housing_ratio'] = matrix['Housing'] & (ratio(accommodation, income) > TIP_THRESHOLDS['housing_ratio'])
+    matrix['food_ratio'] = matrix['Food'] & (ratio(food, income) > TIP_THRESHOLDS['food_ratio'])
+    matrix['dining_ratio'] = matrix['Food'] & (ratio(dining, food) > TIP_THRESHOLDS['dining_ratio'])
+    matrix['transport_ratio'] = matrix['Transportation'] & (ratio(transport, income) > TIP_THRESHOLDS['transport_ratio'])
+    matrix['entertainment_ratio'] = matrix['Entertainment'] & (ratio(entertainment, income) > TIP_THRESHOLDS['entertainment_ratio'])
+    matrix['savings_rate'] = matrix['Savings'] & (ratio(income - total_expenses, income) < TIP_THRESHOLDS['savings_rate'])
+    return matrix
+
+def tips_from_matrix(row):
+    """Rebuild the generate_optimization_tips dict for one row of the batch matrix"""
+    tips = {}
+    for rule, (section, message) in OPTIMIZATION_TIPS.items():
+        if row[section]:
+            tips.setdefault(section, [])
+            if row[rule]:
+                tips[section].append(message)
+    return tips
+
+def tips_matrix_to_long(matrix):
+    """Long format (Name, Section, Tip) with one row per tip given"""
+    frames = []
+    for rule, (section, message) in OPTIMIZATION_TIPS.items():
+        names = matrix.loc[matrix[rule].to_numpy(), 'Name']
+        frames.append(pd.DataFrame({'Name': names.to_numpy(), 'Section': section, 'Tip': message}))
+    return pd.concat(frames, ignore_index=True)
+
+# Offline reporting over the sorted base file: workers each sum a contiguous
+# byte range of whole users, so no user's rows are split across processes
+REPORT_PARTITION_BYTES = 64 << 20   # most of expenses.csv one worker holds at once
+REPORT_CHUNK_ROWS = 200000          # rows parsed at a time inside a partition
+
+def snapshot_expense_partitions(snapshot_path, parts=1, max_bytes=REPORT_PARTITION_BYTES):
+    """Pin the sorted base expenses file at snapshot_path and split it into user ranges
+
+    Compacts the journal first so the base file is sorted and indexed, then
+    hard-links it (later compactions swap in a new file and leave the link
+    intact), or copies it when snapshot_path is on another filesystem. Returns ([start, end) byte ranges, frame of rows journaled since).
+    Ranges hold whole users, at least parts of them when there are enough users
+    and each at most max_bytes unless one user alone is larger.
+    """
+    if STORAGE_BACKEND != 'csv':
+        raise ValueError("offline reports read expenses.csv; export the other backends with migrate_storage.py")
+    flush_writes()
+    compact_expense_journal()
+    with _storage_lock(EXPENSES_LOCK_FILE, shared=True):
+        index = _load_expense_index() if os.path.exists(EXPENSES_FILE) else {}
+        if index is None:
+            raise RuntimeError("expenses.csv has no up-to-date index; run compact_expense_journal")
+        if index:
+            try:
+                os.link(EXPENSES_FILE, snapshot_path)
+            except OSError:
+                shutil.copyfile(EXPENSES_FILE, snapshot_path)
+        journals = [open(path, 'rb') for path in _journal_segments() + [EXPENSES_JOURNAL_FILE]
+                    if os.path.exists(path)]
+    frames = _read_journals(journals)
+    journal_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=EXPENSE_COLUMNS)
+
+    ranges = sorted(index.values())
+    if not ranges:
+        return [], journal_df
+    target = min(max_bytes, max(1, (ranges[-1][1] - ranges[0][0]) // max(parts, 1)))
+    partitions = []
+    start = ranges[0][0]
+    for _, end in ranges:
+        if end - start >= target:
+            partitions.append((start, end))
+            start = end
+    if start < ranges[-1][1]:
+        partitions.append((start, ranges[-1][1]))
+    return partitions, journal_df
+
+def expense_category_totals(expenses_df):
+    """Users x categories frame of expense sums (rows without a category count as 'Other')"""
+    amounts = pd.to_numeric(expenses_df['Amount'], errors='coerce')
+    categories = expenses_df['Category'].fillna('Other')
+    sums = amounts.groupby([expenses_df['Username'], categories], sort=False).sum()
+    return sums.unstack(fill_value=0.0)
+
+def merge_category_totals(frames):
+    """Add up users x categories frames (users or categories missing from one count as 0)"""
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(index=pd.Index([], name='Username'))
+    return pd.concat(frames).fillna(0.0).groupby(level=0).sum()
+
+def expense_partition_totals(path, start, end, chunk_rows=REPORT_CHUNK_ROWS):
+    """Users x categories expense sums over one byte range of the sorted base file"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return merge_category_totals([expense_category_totals(chunk) for chunk in pd.read_csv(
+        io.BytesIO(data), header=None, names=EXPENSE_COLUMNS, usecols=['Username', 'Category', 'Amount'],
+        dtype={'Username': str, 'Category': str}, chunksize=chunk_rows
+    )])
+
+def expense_report(users_df, category_totals):
+    """One row per user: the calculate_expense_metrics figures, spending per category and tips
+
+    category_totals is a users x categories frame of expense sums (users missing
+    from it spent nothing); the tips follow generate_optimization_tips.
+    """
+    names = users_df['Name']
+    by_category = category_totals.reindex(names).fillna(0.0)
+    totals = by_category.sum(axis=1).to_numpy()
+    income = pd.to_numeric(users_df['Monthly_Income'], errors='coerce').to_numpy(dtype=float)
+    ratio = np.zeros(len(users_df))
+    np.divide(totals * 100, income, out=ratio, where=income > 0)
+
+    report = pd.DataFrame({
+        'Name': names.to_numpy(),
+        'Total_Expenses': totals,
+        'Monthly_Income': income,
+        'Savings': income - totals,
+        'Expense_Ratio': ratio,
+    })
+    for category in sorted(by_category.columns):
+        report[category] = by_category[category].to_numpy()
+
+    matrix = generate_optimization_tips_batch(users_df, dict(zip(names, totals)))
+    tips = [[] for _ in range(len(users_df))]
+    for rule, (_, message) in OPTIMIZATION_TIPS.items():
+        for position in np.flatnonzero(matrix[rule].to_numpy()):
+            tips[position].append(message)
+    report['Tips'] = [' | '.join(messages) for messages in tips]
+    return report